@@ -2,12 +2,22 @@ import os
 import logging
 import json
 import re
-from urllib.parse import urlparse, parse_qs
+import copy
+from urllib.parse import urlparse, parse_qs, quote
 from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for
 import yt_dlp
+from yt_dlp.networking import Request as YDLRequest
+from yt_dlp.networking.exceptions import HTTPError as YDLHTTPError
 import tempfile
+import sqlite3
 import threading
+import hashlib
+import shutil
+import subprocess
 import time
+from collections import OrderedDict, deque
+from contextlib import closing, contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from werkzeug.wrappers.response import Response
@@ -16,6 +26,10 @@ try:
     _CORS_AVAILABLE = True
 except Exception:
     _CORS_AVAILABLE = False
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Optional FFmpeg path detection
 def _detect_ffmpeg_path():
@@ -58,259 +72,2695 @@ def _resolve_cookies_file():
             return None
     return None
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Base path for subdirectory deployments (e.g., /yt)
+BASE_PATH = os.environ.get("BASE_PATH", "").strip()
+if BASE_PATH and not BASE_PATH.startswith("/"):
+    BASE_PATH = f"/{BASE_PATH}"
+
+# Create Flask app
+app = Flask(__name__)
+app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
+app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+# Enable CORS when serving API for a static site on another domain
+if os.environ.get("ENABLE_CORS", "false").lower() in ("1", "true", "yes") and _CORS_AVAILABLE:
+    origins = os.environ.get("CORS_ORIGINS", "*")
+    try:
+        CORS(app, resources={r"/*": {"origins": origins}})
+    except Exception:
+        pass
+
+# Directory where converted files are written and served from
+DOWNLOADS_DIR = os.path.join(os.getcwd(), 'downloads')
+
+class JobRecord:
+    """Compact progress record: fixed slots instead of a per-job dict.
+
+    Fields outside the fixed set are kept in `extra`; unset fields are left
+    out of the dict form.
+    """
+
+    __slots__ = (
+        'status', 'stage', 'percent', 'stage_percent', 'downloaded_bytes', 'total_bytes',
+        'speed', 'eta', 'output_bytes', 'queue_position', 'started_at', 'updated_at',
+        'file_path', 'filename', 'cached', 'remuxed', 'error', 'timings', 'extra'
+    )
+
+    def __init__(self, fields):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.update(fields)
+
+    def update(self, fields):
+        for name, value in fields.items():
+            if name != 'extra' and name in self.__slots__:
+                setattr(self, name, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[name] = value
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__[:-1] if getattr(self, name) is not None}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @property
+    def finished(self):
+        return self.status in ('completed', 'error')
+
+class MemoryJobStore:
+    """Progress records kept in this process; enough for a single worker.
+
+    Finished records expire `ttl` seconds after their last update and the
+    store never holds more than `max_entries` records (oldest dropped first,
+    finished ones before running ones).
+    """
+
+    # Seconds between two expiry sweeps
+    PRUNE_INTERVAL = 30
+
+    def __init__(self, ttl=3600, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+        self._claims = {}
+        self._last_prune = time.monotonic()
+        self._init_change_tracking()
+
+    def _init_change_tracking(self):
+        # Per-record version counters let progress streams sleep until
+        # their own record changes in this process
+        self._changed = threading.Condition()
+        self._versions = {}
+
+    def _notify(self, progress_ids):
+        with self._changed:
+            for progress_id in progress_ids:
+                self._versions[progress_id] = self._versions.get(progress_id, 0) + 1
+            self._changed.notify_all()
+
+    def _forget_versions(self, progress_ids):
+        with self._changed:
+            for progress_id in progress_ids:
+                self._versions.pop(progress_id, None)
+
+    def wait_for_change(self, progress_id, seen_version, timeout):
+        """Block until progress_id changes in this process or timeout expires; return its version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._versions.get(progress_id, 0) != seen_version, timeout)
+            return self._versions.get(progress_id, 0)
+
+    def _prune_locked(self):
+        """Drop expired records and enforce max_entries; caller holds the lock."""
+        removed = []
+        now = time.monotonic()
+        if now - self._last_prune >= self.PRUNE_INTERVAL:
+            self._last_prune = now
+            cutoff = time.time() - self.ttl
+            for progress_id, record in list(self._records.items()):
+                if record.finished and (record.updated_at or 0) < cutoff:
+                    del self._records[progress_id]
+                    removed.append(progress_id)
+        if len(self._records) > self.max_entries:
+            excess = len(self._records) - self.max_entries
+            finished = [pid for pid, record in self._records.items() if record.finished][:excess]
+            for progress_id in finished:
+                del self._records[progress_id]
+            removed.extend(finished)
+            while len(self._records) > self.max_entries:
+                removed.append(self._records.popitem(last=False)[0])
+        return removed
+
+    def get(self, progress_id, default=None):
+        with self._lock:
+            record = self._records.get(progress_id)
+            return record.to_dict() if record is not None else default
+
+    def set(self, progress_id, record):
+        self.set_many([progress_id], record)
+
+    def set_many(self, progress_ids, record):
+        """Store the same record under several progress IDs in one step."""
+        with self._lock:
+            for progress_id in progress_ids:
+                self._records[progress_id] = JobRecord(record)
+            removed = self._prune_locked()
+        self._notify(progress_ids)
+        self._forget_versions(removed)
+
+    def update(self, progress_ids, fields):
+        """Merge fields into existing records atomically."""
+        with self._lock:
+            for progress_id in progress_ids:
+                record = self._records.get(progress_id)
+                if record is not None:
+                    record.update(fields)
+        self._notify(progress_ids)
+
+    def claim(self, key, owner, ttl, stale_owner=None):
+        """Try to make owner the only runner of the conversion for key; return the current owner.
+
+        The claim is taken when nobody holds it, when it has expired (`ttl`
+        seconds after it was taken) or when stale_owner holds it.
+        """
+        now = time.time()
+        with self._lock:
+            current = self._claims.get(key)
+            if current is None or current[1] < now or current[0] in (owner, stale_owner):
+                current = self._claims[key] = (owner, now + ttl)
+            return current[0]
+
+    def release_claim(self, key, owner):
+        with self._lock:
+            if self._claims.get(key, (None,))[0] == owner:
+                del self._claims[key]
+
+    def claimed_keys(self):
+        """Keys of the conversions currently claimed by a worker."""
+        now = time.time()
+        with self._lock:
+            return {key for key, (_, expires_at) in self._claims.items() if expires_at >= now}
+
+    def page(self, status=None, offset=0, limit=50):
+        """Return (total, [(progress_id, record), ...]) newest first, optionally filtered by status."""
+        with self._lock:
+            items = [(pid, record) for pid, record in reversed(self._records.items())
+                     if status is None or record.status == status]
+            return len(items), [(pid, record.to_dict()) for pid, record in items[offset:offset + limit]]
+
+    # Dict-style access, as conversion_progress used to be a plain dict
+    def __getitem__(self, progress_id):
+        record = self.get(progress_id)
+        if record is None:
+            raise KeyError(progress_id)
+        return record
+
+    def __setitem__(self, progress_id, record):
+        self.set(progress_id, record)
+
+    def __contains__(self, progress_id):
+        return self.get(progress_id) is not None
+
+class SQLiteJobStore(MemoryJobStore):
+    """Progress records in a SQLite database (WAL mode) shared by every worker process.
+
+    Each thread gets its own connection; every operation is a single
+    statement or transaction, so updates from different processes never
+    interleave within a record.
+    """
+
+    def __init__(self, path, ttl=3600, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._prune_lock = threading.Lock()
+        self._last_prune = 0.0
+        self._init_change_tracking()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'progress_id TEXT PRIMARY KEY, record TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS claims ('
+            'key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, progress_id, default=None):
+        row = self._conn().execute('SELECT record FROM jobs WHERE progress_id = ?', (progress_id,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_many(self, progress_ids, record):
+        payload, now = json.dumps(record), time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT OR REPLACE INTO jobs (progress_id, record, updated_at) VALUES (?, ?, ?)',
+                [(progress_id, payload, now) for progress_id in progress_ids]
+            )
+        self._notify(progress_ids)
+        self._prune()
+
+    def _prune(self):
+        """Delete expired finished records and the oldest ones beyond max_entries."""
+        now = time.monotonic()
+        with self._prune_lock:
+            if now - self._last_prune < self.PRUNE_INTERVAL:
+                return
+            self._last_prune = now
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "DELETE FROM jobs WHERE updated_at < ? "
+                "AND json_extract(record, '$.status') IN ('completed', 'error')",
+                (time.time() - self.ttl,)
+            )
+            conn.execute(
+                'DELETE FROM jobs WHERE progress_id IN ('
+                'SELECT progress_id FROM jobs ORDER BY updated_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            conn.execute('DELETE FROM claims WHERE expires_at < ?', (time.time(),))
+        remaining = {row[0] for row in conn.execute('SELECT progress_id FROM jobs')}
+        with self._changed:
+            # Version counters are only needed for records that still exist
+            self._versions = {pid: v for pid, v in self._versions.items() if pid in remaining}
+
+    def update(self, progress_ids, fields):
+        payload, now = json.dumps(fields), time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'UPDATE jobs SET record = json_patch(record, ?), updated_at = ? WHERE progress_id = ?',
+                [(payload, now, progress_id) for progress_id in progress_ids]
+            )
+        self._notify(progress_ids)
+
+    def claim(self, key, owner, ttl, stale_owner=None):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO claims (key, owner, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+                'WHERE claims.expires_at < ? OR claims.owner IN (?, ?)',
+                (key, owner, now + ttl, now, owner, stale_owner)
+            )
+            return conn.execute('SELECT owner FROM claims WHERE key = ?', (key,)).fetchone()[0]
+
+    def release_claim(self, key, owner):
+        self._conn().execute('DELETE FROM claims WHERE key = ? AND owner = ?', (key, owner))
+
+    def claimed_keys(self):
+        rows = self._conn().execute('SELECT key FROM claims WHERE expires_at >= ?', (time.time(),))
+        return {row[0] for row in rows}
+
+    def page(self, status=None, offset=0, limit=50):
+        conn = self._conn()
+        where, params = ('', ()) if status is None else ("WHERE json_extract(record, '$.status') = ?", (status,))
+        total = conn.execute(f'SELECT COUNT(*) FROM jobs {where}', params).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT progress_id, record FROM jobs {where} ORDER BY updated_at DESC LIMIT ? OFFSET ?',
+            (*params, limit, offset)
+        ).fetchall()
+        return total, [(progress_id, json.loads(record)) for progress_id, record in rows]
+
+def _create_job_store():
+    """Build the job store selected by JOB_STORE ('memory' or 'sqlite')."""
+    backend = os.environ.get('JOB_STORE', 'memory').lower()
+    ttl = int(os.environ.get('JOB_TTL', '3600'))
+    max_entries = int(os.environ.get('JOB_MAX_ENTRIES', '10000'))
+    if backend == 'sqlite':
+        path = os.environ.get('JOB_STORE_PATH', os.path.join(DOWNLOADS_DIR, '.jobs.sqlite3'))
+        return SQLiteJobStore(path, ttl=ttl, max_entries=max_entries)
+    if backend != 'memory':
+        logger.warning(f"Unknown JOB_STORE '{backend}', using memory")
+    return MemoryJobStore(ttl=ttl, max_entries=max_entries)
+
+# Conversion progress records, keyed by progress_id
+conversion_progress = _create_job_store()
+
+class Metrics:
+    """Counters, gauges and histograms exported in the Prometheus text format.
+
+    Each process keeps its own values and a background thread dumps them to
+    <directory>/<pid>.json; /metrics merges the files of every live process,
+    so whichever gunicorn worker answers reports for the whole instance.
+    Gauges are sampled from registered collectors when a dump is written.
+    Counters and histograms of dead workers are folded into
+    <directory>/retired.json, so totals never go backwards when a worker
+    is recycled (as in prometheus_client's multiprocess mode).
+    """
+
+    RETIRED_NAME = 'retired.json'
+
+    # Default histogram buckets, in seconds
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, directory, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._families = {}
+        self._values = {}
+        self._collectors = []
+        self._thread = None
+
+    def describe(self, name, kind, help_text, buckets=None):
+        """Declare a metric family ('counter', 'gauge' or 'histogram')."""
+        self._families[name] = (kind, help_text, tuple(buckets or self.BUCKETS) if kind == 'histogram' else None)
+
+    def collector(self, fn):
+        """Register fn() returning [(name, labels, value), ...] sampled at dump time."""
+        self._collectors.append(fn)
+        return fn
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        buckets = self._families[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def start(self):
+        """Start the dump thread (idempotent)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Metrics flush error: {str(e)}")
+
+    def _rows(self):
+        with self._lock:
+            rows = [
+                [name, dict(labels), [list(value[0]), value[1], value[2]] if isinstance(value, list) else value]
+                for (name, labels), value in self._values.items()
+            ]
+        for fn in self._collectors:
+            try:
+                rows.extend([name, labels, value] for name, labels, value in fn())
+            except Exception as e:
+                logger.warning(f"Metrics collector error: {str(e)}")
+        return rows
+
+    def flush(self):
+        """Write this process's values to its dump file."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._rows(), f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def _accumulate(merged, rows):
+        for name, labels, value in rows:
+            key = (name, tuple(sorted(labels.items())))
+            current = merged.get(key)
+            if isinstance(value, list):
+                if current is None:
+                    merged[key] = [list(value[0]), value[1], value[2]]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+            else:
+                merged[key] = (current or 0) + value
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _retire(self, path):
+        """Fold a dead worker's counters and histograms into the retired dump and drop its file."""
+        retired_path = os.path.join(self.directory, self.RETIRED_NAME)
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another worker may have retired it while we waited for the lock
+            if not os.path.exists(path):
+                return
+            rows = [row for row in self._load(path) if self._families.get(row[0], ('gauge',))[0] != 'gauge']
+            retired = {}
+            self._accumulate(retired, self._load(retired_path))
+            self._accumulate(retired, rows)
+            tmp_path = f'{retired_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([[name, dict(labels), value] for (name, labels), value in retired.items()], f)
+            os.replace(tmp_path, retired_path)
+            os.remove(path)
+
+    def _merged(self):
+        """Sum the dumps of all live processes and the retired totals of dead ones."""
+        self.flush()
+        live = []
+        for entry in os.scandir(self.directory):
+            stem, ext = os.path.splitext(entry.name)
+            if ext != '.json' or not stem.isdigit():
+                continue
+            if self._alive(int(stem)):
+                live.append(entry.path)
+                continue
+            try:
+                self._retire(entry.path)
+            except OSError as e:
+                logger.warning(f"Could not retire metrics of worker {stem}: {str(e)}")
+        merged = {}
+        for path in (os.path.join(self.directory, self.RETIRED_NAME), *live):
+            self._accumulate(merged, self._load(path))
+        return merged
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        """Return all metrics of all workers in the Prometheus text exposition format."""
+        merged = self._merged()
+        lines = []
+        for name, (kind, help_text, buckets) in self._families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(merged.items()):
+                if metric != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f'{name}{self._labels(labels)} {value}')
+                    continue
+                counts, total, count = value
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {bucket_count}')
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{name}_sum{self._labels(labels)} {total}')
+                lines.append(f'{name}_count{self._labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(
+    directory=os.environ.get('METRICS_DIR', os.path.join(DOWNLOADS_DIR, '.metrics')),
+    flush_interval=float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+)
+metrics.describe('ytconv_extraction_seconds', 'histogram', 'Metadata extraction latency per extractor config.')
+metrics.describe('ytconv_download_seconds', 'histogram', 'Source audio download duration.')
+metrics.describe('ytconv_download_bytes_total', 'counter', 'Source audio bytes downloaded.')
+metrics.describe('ytconv_transcode_seconds', 'histogram', 'FFmpeg encode or remux duration.')
+metrics.describe('ytconv_queue_depth', 'gauge', 'Conversion jobs waiting for a download or transcode worker.')
+metrics.describe('ytconv_active_jobs', 'gauge', 'Conversion jobs being processed.')
+metrics.describe('ytconv_ffmpeg_processes', 'gauge', 'FFmpeg processes running.')
+metrics.describe('ytconv_ffmpeg_waiting', 'gauge', 'Conversions waiting for an FFmpeg slot.')
+metrics.describe('ytconv_cache_requests_total', 'counter', 'Cache lookups by cache, result and lookup site.')
+metrics.describe('ytconv_served_bytes_total', 'counter', 'Audio bytes sent to clients.')
+metrics.describe('ytconv_errors_total', 'counter', 'Failed conversions by stage and error class.')
+
+# Encoding settings for converted files (part of the output cache key)
+AUDIO_CODEC = 'mp3'
+AUDIO_QUALITY = '192'
+
+# Output formats accepted by /convert and /api/convert. When the source
+# audio already uses the target codec it is remuxed (stream copy) instead
+# of being decoded and re-encoded.
+OUTPUT_FORMATS = {
+    'mp3': {
+        'quality': AUDIO_QUALITY,
+        'mimetype': 'audio/mpeg',
+        'selector': 'bestaudio/best',
+        'source_codecs': ('mp3',),
+        'encoder': ['-c:a', 'libmp3lame', '-b:a', f'{AUDIO_QUALITY}k'],
+        'muxer': ['-f', 'mp3'],
+        'stream_muxer': ['-f', 'mp3'],
+    },
+    'm4a': {
+        'quality': '192',
+        'mimetype': 'audio/mp4',
+        'selector': 'bestaudio[ext=m4a]/bestaudio/best',
+        'source_codecs': ('mp4a', 'aac'),
+        'encoder': ['-c:a', 'aac', '-b:a', '192k'],
+        'muxer': ['-f', 'ipod', '-movflags', '+faststart'],
+        # MP4 needs a seekable output unless it is fragmented
+        'stream_muxer': ['-f', 'ipod', '-movflags', '+frag_keyframe+empty_moov'],
+    },
+    'opus': {
+        'quality': '128',
+        'mimetype': 'audio/ogg',
+        'selector': 'bestaudio[acodec=opus]/bestaudio/best',
+        'source_codecs': ('opus',),
+        'encoder': ['-c:a', 'libopus', '-b:a', '128k'],
+        'muxer': ['-f', 'opus'],
+        'stream_muxer': ['-f', 'opus'],
+    },
+}
+
+def _requested_format(data):
+    """Return the output format asked for in request data (default mp3), or None if unsupported."""
+    output_format = (data.get('format') or AUDIO_CODEC).strip().lower()
+    return output_format if output_format in OUTPUT_FORMATS else None
+
+class OutputCache:
+    """Persistent index of converted files keyed by (video ID, codec, quality).
+
+    File entries live in a SQLite database (WAL mode) next to the files
+    they describe, so they survive restarts and every worker process can
+    add and drop entries without losing the others' writes. Cache hits and
+    downloads only read it: access times are buffered in memory per file
+    and written in one batch at most every ACCESS_FLUSH_INTERVAL seconds.
+    A second table maps progress IDs to the exact file their job produced,
+    so /download never has to search the directory.
+    """
+
+    # Progress IDs remembered for /download, oldest dropped first
+    MAX_JOB_LINKS = 5000
+    # Seconds between two writes of buffered access times
+    ACCESS_FLUSH_INTERVAL = 60
+    # Minimum seconds between two passes dropping surplus job links
+    PRUNE_INTERVAL = 30
+
+    def __init__(self, directory, db_name='.cache.sqlite3'):
+        self.directory = directory
+        self.path = os.path.join(directory, db_name)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._accessed = {}
+        self._last_flush = time.monotonic()
+        self._last_prune = 0.0
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS outputs ('
+            'key TEXT PRIMARY KEY, video_id TEXT NOT NULL, codec TEXT NOT NULL, quality TEXT, '
+            'file_path TEXT NOT NULL, title TEXT, size INTEGER NOT NULL, '
+            'created_at REAL NOT NULL, last_access REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS outputs_file_path ON outputs (file_path)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS job_links ('
+            'progress_id TEXT PRIMARY KEY, file_path TEXT NOT NULL, filename TEXT, created_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS job_links_created_at ON job_links (created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS job_links_file_path ON job_links (file_path)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql, params=()):
+        """Run one write statement; failures (full disk, lock timeout) are logged, not raised."""
+        try:
+            self._conn().execute(sql, params)
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write output cache index: {e}")
+            return False
+
+    @staticmethod
+    def make_key(video_id, codec, quality):
+        return f"{video_id}:{codec}:{quality}"
+
+    def _record_access(self, file_path):
+        """Buffer an access time for file_path, flushing the buffer when it is due."""
+        now = time.time()
+        with self._lock:
+            self._accessed[file_path] = now
+            if time.monotonic() - self._last_flush < self.ACCESS_FLUSH_INTERVAL:
+                return
+        self.flush_access()
+
+    def flush_access(self):
+        """Write buffered access times to the index."""
+        with self._lock:
+            pending, self._accessed = self._accessed, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        conn = self._conn()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany(
+                    'UPDATE outputs SET last_access = MAX(last_access, ?) WHERE file_path = ?',
+                    [(ts, file_path) for file_path, ts in pending.items()]
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write output cache index: {e}")
+
+    def get(self, video_id, codec=AUDIO_CODEC, quality=None, site='request'):
+        """Return the cache entry for a video, or None if it is missing or stale.
+
+        site labels the lookup in the metrics: 'request' for the check made
+        when a request arrives, 'job' for the re-checks of a running job.
+        """
+        if not video_id:
+            return None
+        key = self.make_key(video_id, codec, quality or OUTPUT_FORMATS[codec]['quality'])
+        try:
+            row = self._conn().execute('SELECT * FROM outputs WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read output cache index: {e}")
+            row = None
+        if row is None:
+            metrics.inc('ytconv_cache_requests_total', cache='output', result='miss', site=site)
+            return None
+        entry = dict(row)
+        file_path = entry['file_path']
+        if not os.path.isfile(file_path) or os.path.getsize(file_path) != entry['size']:
+            # File was removed or replaced behind our back
+            self._write('DELETE FROM outputs WHERE key = ? AND file_path = ?', (key, file_path))
+            metrics.inc('ytconv_cache_requests_total', cache='output', result='miss', site=site)
+            return None
+        self._record_access(file_path)
+        metrics.inc('ytconv_cache_requests_total', cache='output', result='hit', site=site)
+        del entry['key']
+        return entry
+
+    def put(self, video_id, file_path, title, codec=AUDIO_CODEC, quality=None):
+        """Record a freshly converted file in the index."""
+        if not video_id or not file_path or not os.path.isfile(file_path):
+            return
+        now = time.time()
+        quality = quality or OUTPUT_FORMATS[codec]['quality']
+        self._write(
+            'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (self.make_key(video_id, codec, quality), video_id, codec, quality, file_path, title,
+             os.path.getsize(file_path), now, now)
+        )
+
+    def link(self, progress_ids, file_path, filename):
+        """Remember the file produced for each of progress_ids."""
+        if not file_path:
+            return
+        now = time.time()
+        try:
+            self._conn().executemany(
+                'INSERT OR REPLACE INTO job_links VALUES (?, ?, ?, ?)',
+                [(progress_id, file_path, filename, now) for progress_id in progress_ids]
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write output cache index: {e}")
+        self._prune_links()
+
+    def _prune_links(self):
+        """Drop the oldest job links beyond MAX_JOB_LINKS."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune < self.PRUNE_INTERVAL:
+                return
+            self._last_prune = now
+        self._write(
+            'DELETE FROM job_links WHERE progress_id IN ('
+            'SELECT progress_id FROM job_links ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+            (self.MAX_JOB_LINKS,)
+        )
+
+    def touch(self, file_path):
+        """Mark the entry for file_path as just used (drives LRU eviction)."""
+        self._record_access(file_path)
+
+    def last_access(self):
+        """Return {file_path: last access time} for every indexed file."""
+        self.flush_access()
+        try:
+            rows = self._conn().execute('SELECT file_path, last_access FROM outputs').fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read output cache index: {e}")
+            return {}
+        return {file_path: ts for file_path, ts in rows}
+
+    def forget(self, file_paths):
+        """Drop index entries and job links pointing at removed files."""
+        file_paths = set(file_paths)
+        if not file_paths:
+            return
+        conn = self._conn()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('DELETE FROM outputs WHERE file_path = ?', [(p,) for p in file_paths])
+                conn.executemany('DELETE FROM job_links WHERE file_path = ?', [(p,) for p in file_paths])
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write output cache index: {e}")
+
+    def get_for_job(self, progress_id):
+        """Return {'file_path', 'filename'} for a finished job, or None."""
+        try:
+            row = self._conn().execute(
+                'SELECT file_path, filename FROM job_links WHERE progress_id = ?', (progress_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read output cache index: {e}")
+            return None
+        if row and os.path.isfile(row['file_path']):
+            return dict(row)
+        return None
+
+output_cache = OutputCache(DOWNLOADS_DIR)
+
+class MetadataCache:
+    """Bounded in-process cache of video metadata with TTL expiry and LRU eviction.
+
+    Values are copied in and out with `copy` (shallow by default), so
+    callers never share a cached value.
+    """
+
+    def __init__(self, max_entries=512, ttl=600, copy=dict):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._copy = copy
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        if not key:
+            return None
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = item[1]
+        return self._copy(value)
+
+    def put(self, key, value):
+        if not key or not value:
+            return
+        value = self._copy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+metadata_cache = MetadataCache(
+    max_entries=int(os.environ.get('METADATA_CACHE_SIZE', '512')),
+    ttl=int(os.environ.get('METADATA_CACHE_TTL', '600'))
+)
+
+# Unprocessed extraction results, so /validate or /api/convert followed by
+# the download does not extract twice. Kept briefly: they carry signed
+# stream URLs. Deep copies, as format selection modifies the info dict.
+extract_cache = MetadataCache(
+    max_entries=int(os.environ.get('EXTRACT_CACHE_SIZE', '128')),
+    ttl=int(os.environ.get('EXTRACT_CACHE_TTL', '300')),
+    copy=copy.deepcopy
+)
+
+@metrics.collector
+def _metadata_cache_metrics():
+    stats = metadata_cache.stats()
+    return [
+        ('ytconv_cache_requests_total', {'cache': 'metadata', 'result': 'hit'}, stats['hits']),
+        ('ytconv_cache_requests_total', {'cache': 'metadata', 'result': 'miss'}, stats['misses'])
+    ]
+
+class ConversionJob:
+    """A single download/conversion shared by every request for the same video and settings."""
+
+    def __init__(self, key, progress_id, output_format=AUDIO_CODEC):
+        self.key = key
+        self.output_format = output_format
+        self.started_at = time.time()
+        self.progress_ids = [progress_id]
+        self.done = threading.Event()
+        self.result = None
+        # Files and directories this job is writing, protected from the janitor
+        self.paths = set()
+        # Whether this worker holds the job's claim in the shared job store
+        self.claimed = False
+        self._lock = threading.Lock()
+        self._last_record = None
+        self._last_write = 0.0
+        # Seconds spent in each pipeline stage, reported with every record
+        self._spans = {}
+
+    @property
+    def last_record(self):
+        with self._lock:
+            return dict(self._last_record) if self._last_record else None
+
+    def attach(self, progress_id):
+        """Follow this job under another progress_id, starting from its current state."""
+        with self._lock:
+            self.progress_ids.append(progress_id)
+            if self._last_record is not None:
+                self._write(conversion_progress.set, progress_id, self._last_record)
+
+    @property
+    def stage(self):
+        with self._lock:
+            return self._last_record.get('stage') if self._last_record else None
+
+    @property
+    def timings(self):
+        with self._lock:
+            return dict(self._spans)
+
+    def record_span(self, name, seconds):
+        """Add seconds to the time spent in stage name."""
+        with self._lock:
+            self._spans[name] = round(self._spans.get(name, 0) + seconds, 3)
+
+    @contextmanager
+    def span(self, name):
+        """Time the enclosed block as stage name."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.monotonic() - started)
+
+    def publish(self, record):
+        """Write a progress record for every request following this job."""
+        now = time.time()
+        record = {**record, 'started_at': self.started_at, 'updated_at': now}
+        with self._lock:
+            if self._spans:
+                record['timings'] = dict(self._spans)
+            self._last_record = record
+            self._last_write = now
+            self._write(conversion_progress.set_many, self.progress_ids, record)
+
+    def tick(self, fields):
+        """Merge telemetry into the current record, at most once per PROGRESS_UPDATE_INTERVAL."""
+        now = time.time()
+        with self._lock:
+            if self._last_record is None or now - self._last_write < PROGRESS_UPDATE_INTERVAL:
+                return
+            fields = {**fields, 'updated_at': now}
+            self._last_record = {**self._last_record, **fields}
+            self._last_write = now
+            self._write(conversion_progress.update, self.progress_ids, fields)
+
+    def _write(self, write, *args):
+        """Run one job store write; failures (lock timeout, full disk) are logged, not raised."""
+        try:
+            write(*args)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write progress of {self.key}: {e}")
+
+# Minimum seconds between two telemetry writes for the same job; status
+# changes are always written straight away
+PROGRESS_UPDATE_INTERVAL = float(os.environ.get('PROGRESS_UPDATE_INTERVAL', '0.5'))
+
+# In-flight conversions keyed by video ID and encoding settings
+_inflight_jobs = {}
+_inflight_lock = threading.Lock()
+
+# Across worker processes, a conversion is run by the worker holding its
+# claim in the job store for at most JOB_CLAIM_TTL seconds; the others
+# follow its record and take over when it shows no progress for
+# JOB_CLAIM_STALE seconds
+JOB_CLAIM_TTL = int(os.environ.get('JOB_CLAIM_TTL', '3600'))
+JOB_CLAIM_STALE = int(os.environ.get('JOB_CLAIM_STALE', '300'))
+
+class QueueFullError(Exception):
+    """Raised when the conversion queue cannot accept another job."""
+
+class ConversionScheduler:
+    """Fixed pool of worker threads draining a bounded queue of conversion jobs.
+
+    Workers are started lazily on first use so that forking servers
+    (gunicorn with preload) get their threads in each worker process.
+    """
+
+    def __init__(self, workers, max_queue, transcode_workers=1):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.transcode_workers = max(1, transcode_workers)
+        self._pending = deque()
+        lock = threading.RLock()
+        self._cond = threading.Condition(lock)
+        # Signalled when the backlog shrinks, for blocking submitters
+        self._room = threading.Condition(lock)
+        self._threads = []
+        self.active = 0
+        # Jobs handed to the transcode stage and not finished yet; they
+        # still count against the queue until they release their slot
+        self.transcoding = 0
+        self.rejected = 0
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'conversion-worker-{i+1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, url, job, block=False):
+        """Queue a job; raises QueueFullError when the queue is at capacity.
+
+        With block=True the caller waits for room instead of being rejected.
+        """
+        with self._cond:
+            self._ensure_workers()
+            while True:
+                self._pending.append((url, job))
+                # Check the backlog as it stands with this job in it, so that a
+                # job an idle worker picks up right away is never rejected
+                if self._download_backlog() + self._transcode_backlog() <= self.max_queue:
+                    break
+                self._pending.pop()
+                if not block:
+                    self.rejected += 1
+                    raise QueueFullError()
+                self._room.wait()
+            positions = self._queue_positions()
+            self._cond.notify()
+        self._publish_positions(positions)
+
+    def _download_backlog(self):
+        # Jobs that will start immediately are not counted as queued
+        return max(0, len(self._pending) - (self.workers - self.active))
+
+    def _transcode_backlog(self):
+        return max(0, self.transcoding - self.transcode_workers)
+
+    def start_transcode(self, fn, job, *args):
+        """Run fn(job, *args) on the transcode pool; call finish_transcode() when it is done."""
+        with self._cond:
+            self.transcoding += 1
+        try:
+            transcode_pool.submit(fn, job, *args)
+        except Exception:
+            self.finish_transcode()
+            raise
+
+    def finish_transcode(self):
+        with self._cond:
+            self.transcoding -= 1
+            self._room.notify_all()
+
+    def _queue_positions(self):
+        # Snapshot taken under the lock; the store writes happen after it is
+        # released so a slow store does not stall submit() and the workers
+        waiting = self._download_backlog()
+        if not waiting:
+            return []
+        return [(job, position) for position, (_, job) in enumerate(list(self._pending)[-waiting:], start=1)]
+
+    def _publish_positions(self, positions):
+        for job, position in positions:
+            job.publish({
+                'status': 'queued',
+                'percent': 0,
+                'queue_position': position
+            })
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                url, job = self._pending.popleft()
+                self.active += 1
+                positions = self._queue_positions()
+            self._publish_positions(positions)
+            try:
+                _lead_job(url, job)
+            except Exception as e:
+                logger.error(f"Conversion worker error: {str(e)}")
+            finally:
+                with self._cond:
+                    self.active -= 1
+                    self._room.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'active': self.active,
+                'queued': self._download_backlog() + self._transcode_backlog(),
+                'download_queued': self._download_backlog(),
+                'transcode_queued': self._transcode_backlog(),
+                'transcoding': self.transcoding,
+                'max_queue': self.max_queue,
+                'rejected': self.rejected,
+                'transcode_workers': self.transcode_workers
+            }
+
+# Transcode stage: CPU-bound, capped to the number of cores
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', str(os.cpu_count() or 1)))
+transcode_pool = ThreadPoolExecutor(max_workers=max(1, TRANSCODE_WORKERS), thread_name_prefix='transcode')
+
+# Download stage: network-bound, so it gets more threads than there are cores.
+# The queue bound covers jobs waiting for either stage.
+scheduler = ConversionScheduler(
+    workers=int(os.environ.get('CONVERSION_WORKERS', str(2 * (os.cpu_count() or 1)))),
+    max_queue=int(os.environ.get('CONVERSION_QUEUE_SIZE', '20')),
+    transcode_workers=TRANSCODE_WORKERS
+)
+
+@metrics.collector
+def _scheduler_metrics():
+    stats = scheduler.stats()
+    return [
+        ('ytconv_queue_depth', {'stage': 'download'}, stats['download_queued']),
+        ('ytconv_queue_depth', {'stage': 'transcode'}, stats['transcode_queued']),
+        ('ytconv_active_jobs', {}, stats['active'])
+    ]
+
+# Share of the overall percentage attributed to the download stage
+DOWNLOAD_STAGE_SHARE = 80
+
+# Seconds clients are told to wait before retrying when the queue is full
+RETRY_AFTER_SECONDS = int(os.environ.get('CONVERSION_RETRY_AFTER', '10'))
+
+class ProgressHook:
+    def __init__(self, job):
+        self.job = job
+        
+    def __call__(self, d):
+        if d['status'] == 'downloading':
+            downloaded = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            percent = (downloaded / total) * 100 if total else 0
+            
+            _publish_stage(
+                self.job, 'download', percent,
+                downloaded_bytes=downloaded,
+                total_bytes=int(total) if total else None,
+                speed=round(d['speed']) if d.get('speed') else None,
+                eta=d.get('eta')
+            )
+        elif d['status'] == 'finished':
+            total = d.get('total_bytes') or d.get('downloaded_bytes')
+            _publish_stage(self.job, 'download', 100, downloaded_bytes=total, total_bytes=total, speed=None, eta=0)
+
+def _format_rate(bytes_per_second):
+    if bytes_per_second < 1024:
+        return f"{int(bytes_per_second)} o/s"
+    for unit in ('Ko', 'Mo', 'Go'):
+        bytes_per_second /= 1024
+        if bytes_per_second < 1024 or unit == 'Go':
+            return f"{bytes_per_second:.1f} {unit}/s"
+
+def _progress_message(record):
+    """Human-readable message for a progress record, built when it is read."""
+    status = record.get('status')
+    if status == 'queued':
+        if record.get('queue_position'):
+            return f"En file d'attente (position {record['queue_position']})..."
+        return "En file d'attente..."
+    if status == 'starting':
+        return 'Initialisation...'
+    if status == 'downloading':
+        message = f"Téléchargement... {record.get('stage_percent', 0)}%"
+        details = []
+        if record.get('speed'):
+            details.append(_format_rate(record['speed']))
+        if record.get('eta'):
+            details.append(f"{int(record['eta'])} s restantes")
+        return f"{message} ({', '.join(details)})" if details else message
+    if status == 'processing':
+        if record.get('stage') == 'transcode_queue':
+            return 'En attente de conversion...'
+        return f"Conversion en cours... {record.get('stage_percent', 0)}%"
+    if status == 'completed':
+        return 'Conversion terminée!'
+    if status == 'error':
+        return record.get('error') or 'Erreur lors de la conversion'
+    return 'Conversion non trouvée'
+
+def _progress_view(record):
+    """Progress record as returned to clients, with its message."""
+    return {**record, 'message': _progress_message(record)}
+
+def normalize_url(url: str) -> str:
+    url = url.strip()
+    if not re.match(r'^https?://', url):
+        url = 'https://' + url
+    return url
+
+def extract_video_id(url: str):
+    """Return the YouTube video ID contained in a URL, or None."""
+    try:
+        parsed = urlparse(normalize_url(url))
+        host = parsed.netloc.lower()
+        path = parsed.path.rstrip('/')
+        if 'youtu.be' in host:
+            video_id = path.strip('/').split('/')[0]
+        elif path.lower().startswith('/watch'):
+            video_id = parse_qs(parsed.query).get('v', [''])[0]
+        else:
+            match = re.match(r'^/(?:shorts|embed|v|live)/([^/?#]+)', path, re.IGNORECASE)
+            video_id = match.group(1) if match else ''
+        return video_id if re.match(r'^[\w-]{6,}$', video_id) else None
+    except Exception:
+        return None
+
+def extract_playlist_id(url: str):
+    """Return the playlist ID (list= parameter) of a YouTube URL, or None."""
+    try:
+        parsed = urlparse(normalize_url(url))
+        if 'youtube.com' not in parsed.netloc.lower():
+            return None
+        playlist_id = parse_qs(parsed.query).get('list', [''])[0]
+        return playlist_id if re.match(r'^[\w-]{2,}$', playlist_id) else None
+    except Exception:
+        return None
+
+def _cached_progress(entry):
+    """Build a completed progress entry for an output cache hit."""
+    return {
+        'status': 'completed',
+        'percent': 100,
+        'file_path': entry['file_path'],
+        'filename': f"{entry.get('title') or entry['video_id']}.{entry['codec']}",
+        'cached': True,
+        'updated_at': time.time()
+    }
+
+def is_valid_youtube_url(url: str) -> bool:
+    """Validate if the URL is a valid YouTube or youtu.be URL, including Shorts."""
+    try:
+        url = normalize_url(url)
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        path = parsed.path.rstrip('/')
+        qs = parse_qs(parsed.query)
+
+        if 'youtube.com' in host or 'youtu.be' in host or 'm.youtube.com' in host:
+            # youtu.be shortlinks: path contains the ID
+            if 'youtu.be' in host:
+                return bool(path.strip('/'))
+
+            # youtube.com paths
+            p = path.lower()
+            if p.startswith('/watch'):
+                return 'v' in qs and len(qs.get('v', [''])[0]) > 0
+            if p.startswith('/shorts/'):
+                return len(p.split('/shorts/', 1)[-1]) > 0
+            if p.startswith('/embed/') or p.startswith('/v/') or p.startswith('/live/'):
+                return True
+            # Accept music.youtube.com/watch?v=...
+            if p == '/watch' and 'v' in qs:
+                return True
+        return False
+    except Exception:
+        return False
+
+def _summarize_info(info):
+    """Reduce a yt-dlp info dict to the fields exposed by the API."""
+    return {
+        'title': info.get('title', 'Titre non disponible'),
+        'duration': info.get('duration', 0),
+        'uploader': info.get('uploader', 'Inconnu'),
+        'view_count': info.get('view_count', 0),
+        # Unprocessed results only list thumbnails, best last
+        'thumbnail': info.get('thumbnail') or ((info.get('thumbnails') or [{}])[-1].get('url') or ''),
+        'id': info.get('id', '')
+    }
+
+class YtdlCacheDir:
+    """yt-dlp's on-disk cache (player JS signature and n-parameter functions), shared by all workers.
+
+    yt-dlp writes entries atomically but never checks them again: maintain()
+    drops unreadable entries and stale temp files and keeps the directory
+    under `max_bytes`, oldest entries first.
+    """
+
+    # Sections yt-dlp fills when it decodes a YouTube player
+    PLAYER_SECTIONS = ('youtube-sigfuncs', 'youtube-nsig')
+
+    def __init__(self, directory, max_bytes=50 * 1024 ** 2, grace=600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self._lock = threading.Lock()
+        self.usage_bytes = 0
+        self.file_count = 0
+        self.removed_corrupt = 0
+        self.removed_over_budget = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def maintain(self):
+        """Check every entry and enforce the size cap."""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        entries, corrupt = [], 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                    if name.endswith('.tmp'):
+                        # Leftover of an interrupted write
+                        if now - st.st_mtime > self.grace and self._remove(path):
+                            corrupt += 1
+                        continue
+                    with open(path, encoding='utf-8') as f:
+                        entry = json.load(f)
+                    if not isinstance(entry, dict) or 'data' not in entry or 'yt-dlp_version' not in entry:
+                        raise ValueError('not a yt-dlp cache entry')
+                except ValueError:
+                    if self._remove(path):
+                        corrupt += 1
+                    continue
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        entries.sort()
+        usage = sum(size for _, size, _ in entries)
+        over_budget = 0
+        for _, size, path in entries:
+            if usage <= self.max_bytes:
+                break
+            if self._remove(path):
+                usage -= size
+                over_budget += 1
+        if corrupt or over_budget:
+            logger.info(f"yt-dlp cache: removed {corrupt} unreadable and {over_budget} old entries")
+        with self._lock:
+            self.usage_bytes = usage
+            self.file_count = len(entries) - over_budget
+            self.removed_corrupt += corrupt
+            self.removed_over_budget += over_budget
+
+    def is_warm(self, max_age=24 * 3600):
+        """Whether player data fetched in the last max_age seconds is on disk."""
+        now = time.time()
+        for section in self.PLAYER_SECTIONS:
+            path = os.path.join(self.directory, section)
+            if not os.path.isdir(path):
+                continue
+            for entry in os.scandir(path):
+                if entry.name.endswith('.json') and now - entry.stat().st_mtime < max_age:
+                    return True
+        return False
+
+    def prewarm(self, url, ydl_opts):
+        """Extract url once so the player data lands in the cache, unless it is already there."""
+        if not self.enabled or not url or self.is_warm():
+            return
+        started = time.monotonic()
+        try:
+            # Standalone instance: this may run before gunicorn forks
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                ydl.extract_info(url, download=False)
+            logger.info(f"yt-dlp cache pre-warmed in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.warning(f"yt-dlp cache pre-warm failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'usage_bytes': self.usage_bytes,
+                'file_count': self.file_count,
+                'max_bytes': self.max_bytes,
+                'removed_corrupt': self.removed_corrupt,
+                'removed_over_budget': self.removed_over_budget
+            }
+
+# Shared by every worker and kept across restarts with downloads/; set
+# YTDL_CACHE_DIR to an empty string to turn yt-dlp's cache off
+ytdl_cache = YtdlCacheDir(
+    os.environ.get('YTDL_CACHE_DIR', os.path.join(DOWNLOADS_DIR, '.ytdl-cache')),
+    max_bytes=int(os.environ.get('YTDL_CACHE_MAX_BYTES', str(50 * 1024 ** 2)))
+)
+
+def _extractor_configs():
+    """Named yt-dlp option sets tried by get_video_info, most compatible first."""
+    cookies_file = _resolve_cookies_file()
+    cache_opts = {'cachedir': ytdl_cache.directory or False}
+    common_headers = {
+        'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Mobile/15E148 Safari/604.1',
+        'Accept-Language': os.environ.get('ACCEPT_LANGUAGE', 'en-US,en;q=0.9,fr-FR;q=0.8')
+    }
+
+    return [
+        # Configuration 1: Most compatible
+        ('ios', {
+            'quiet': True,
+            'no_warnings': True,
+            'http_headers': common_headers,
+            'extractor_args': {
+                'youtube': {
+                    'player_client': ['ios'],
+                    'skip': ['dash', 'hls']
+                }
+            },
+            **({'cookiefile': cookies_file} if cookies_file else {}),
+            **cache_opts
+        }),
+        # Configuration 2: Android fallback
+        ('android', {
+            'quiet': True,
+            'no_warnings': True,
+            'http_headers': {**common_headers, 'User-Agent': 'com.google.android.youtube/19.09.36 (Linux; U; Android 11) gzip'},
+            'extractor_args': {
+                'youtube': {
+                    'player_client': ['android'],
+                    'skip': ['dash']
+                }
+            },
+            **({'cookiefile': cookies_file} if cookies_file else {}),
+            **cache_opts
+        }),
+        # Configuration 3: Basic web fallback
+        ('web', {
+            'quiet': True,
+            'no_warnings': True,
+            'http_headers': {**common_headers, 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+            **({'cookiefile': cookies_file} if cookies_file else {}),
+            **cache_opts
+        }),
+    ]
+
+class ExtractorHealth:
+    """Sliding-window success rate and latency per extractor config, with a circuit breaker.
+
+    A config that fails `failure_threshold` times in a row is skipped for
+    `cooldown` seconds; after that it gets another try, and a single success
+    closes the breaker again.
+    """
+
+    def __init__(self, window_seconds=900, max_samples=100, failure_threshold=5, cooldown=300):
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._consecutive_failures = {}
+        self._open_until = {}
+
+    def record(self, name, ok, latency):
+        metrics.observe('ytconv_extraction_seconds', latency, config=name, outcome='ok' if ok else 'error')
+        now = time.monotonic()
+        with self._lock:
+            samples = self._samples.setdefault(name, deque(maxlen=self.max_samples))
+            samples.append((now, ok, latency))
+            if ok:
+                self._consecutive_failures[name] = 0
+                self._open_until.pop(name, None)
+            else:
+                failures = self._consecutive_failures.get(name, 0) + 1
+                self._consecutive_failures[name] = failures
+                if failures >= self.failure_threshold:
+                    if name not in self._open_until:
+                        logger.warning(f"Extractor config {name} tripped after {failures} failures, cooling down {self.cooldown}s")
+                    self._open_until[name] = now + self.cooldown
+
+    def _window(self, name, now):
+        samples = self._samples.get(name)
+        if not samples:
+            return []
+        while samples and samples[0][0] < now - self.window_seconds:
+            samples.popleft()
+        return list(samples)
+
+    def _summary(self, name, now):
+        samples = self._window(name, now)
+        successes = [latency for _, ok, latency in samples if ok]
+        return {
+            'samples': len(samples),
+            # Smoothed so untried configs rank in the middle rather than first or last
+            'success_rate': round((len(successes) + 1) / (len(samples) + 2), 3),
+            'avg_latency': round(sum(successes) / len(successes), 3) if successes else None,
+            'consecutive_failures': self._consecutive_failures.get(name, 0),
+            'circuit_open': self._open_until.get(name, 0) > now,
+        }
+
+    def order(self, configs):
+        """Return configs healthiest first, leaving out tripped ones unless all are tripped."""
+        now = time.monotonic()
+        with self._lock:
+            summaries = {name: self._summary(name, now) for name, _ in configs}
+        ranked = sorted(
+            enumerate(configs),
+            key=lambda item: (
+                -round(summaries[item[1][0]]['success_rate'], 1),
+                summaries[item[1][0]]['avg_latency'] if summaries[item[1][0]]['avg_latency'] is not None else float('inf'),
+                item[0],
+            )
+        )
+        ordered = [config for _, config in ranked]
+        closed = [config for config in ordered if not summaries[config[0]]['circuit_open']]
+        return closed or ordered
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {name: self._summary(name, now) for name in self._samples}
+
+extractor_health = ExtractorHealth(
+    window_seconds=int(os.environ.get('EXTRACTOR_HEALTH_WINDOW', '900')),
+    failure_threshold=int(os.environ.get('EXTRACTOR_BREAKER_FAILURES', '5')),
+    cooldown=int(os.environ.get('EXTRACTOR_BREAKER_COOLDOWN', '300'))
+)
+
+# Extractor racing: 'off' tries configs one after another, 'hedge' starts the
+# next config if the previous one has not answered after EXTRACTOR_HEDGE_DELAY
+# seconds, 'all' starts every config at once.
+EXTRACTOR_RACE_MODE = os.environ.get('EXTRACTOR_RACE_MODE', 'off').lower()
+EXTRACTOR_HEDGE_DELAY = float(os.environ.get('EXTRACTOR_HEDGE_DELAY', '1.5'))
+
+class ExtractorPool:
+    """Thread pool for raced extractions that knows how many tasks it holds.
+
+    Losing extractions keep their thread until they finish, so racing
+    requests check `saturated` and stop hedging rather than queue behind them.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='extractor')
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self.pending += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    @property
+    def saturated(self):
+        with self._lock:
+            return self.pending >= self.max_workers
+
+# Room for every extractor config of as many requests as there are
+# conversion workers
+_extractor_pool = ExtractorPool(int(os.environ.get('EXTRACTOR_RACE_WORKERS', str(3 * scheduler.workers))))
+
+class YoutubeDLPool:
+    """Warm yt_dlp.YoutubeDL instances per extractor config, leased to one thread at a time.
+
+    Reusing an instance keeps its HTTP connections and the YouTube
+    extractor's player JS and signature caches between requests. When every
+    instance of a config is leased, a temporary one is built instead of
+    waiting; instances are rebuilt after `max_uses` leases.
+    """
+
+    def __init__(self, size=4, max_uses=200):
+        self.size = size
+        self.max_uses = max_uses
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._pooled = {}
+        self._uses = {}
+        self.created = 0
+        self.reused = 0
+        self.overflow = 0
+
+    def _checkout(self, name, ydl_opts):
+        """Return (instance, pooled); overflow instances are not pooled."""
+        with self._lock:
+            idle = self._idle.setdefault(name, [])
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+            pooled = self._pooled.get(name, 0) < self.size
+            if pooled:
+                self._pooled[name] = self._pooled.get(name, 0) + 1
+            else:
+                self.overflow += 1
+            self.created += 1
+        try:
+            ydl = yt_dlp.YoutubeDL(ydl_opts)
+            # Instantiate the YouTube extractor now rather than on the first request
+            ydl.get_info_extractor('Youtube')
+        except Exception:
+            if pooled:
+                with self._lock:
+                    self._pooled[name] -= 1
+            raise
+        return ydl, pooled
+
+    def _checkin(self, name, ydl, pooled):
+        retire = not pooled
+        if pooled:
+            with self._lock:
+                uses = self._uses.get(id(ydl), 0) + 1
+                if uses >= self.max_uses:
+                    self._uses.pop(id(ydl), None)
+                    self._pooled[name] -= 1
+                    retire = True
+                else:
+                    self._uses[id(ydl)] = uses
+                    self._idle[name].append(ydl)
+        if retire:
+            ydl.close()
+
+    @contextmanager
+    def lease(self, name, ydl_opts):
+        """Yield an instance built with ydl_opts for the config called name."""
+        ydl, pooled = self._checkout(name, ydl_opts)
+        try:
+            yield ydl
+        finally:
+            self._checkin(name, ydl, pooled)
+
+    def warm(self, configs):
+        """Build the pooled instances of every config ahead of the first request."""
+        for name, ydl_opts in configs:
+            leases = []
+            try:
+                for _ in range(self.size):
+                    leases.append(self._checkout(name, ydl_opts))
+            except Exception as e:
+                logger.warning(f"Could not warm yt-dlp instances for {name}: {str(e)}")
+            for ydl, pooled in leases:
+                # Warming is not a use: put instances back without counting
+                if pooled:
+                    with self._lock:
+                        self._idle[name].append(ydl)
+                else:
+                    ydl.close()
+        logger.debug(f"yt-dlp pool warmed: {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'max_uses': self.max_uses,
+                'pooled': dict(self._pooled),
+                'idle': {name: len(idle) for name, idle in self._idle.items()},
+                'created': self.created,
+                'reused': self.reused,
+                'overflow': self.overflow
+            }
+
+ydl_pool = YoutubeDLPool(
+    size=int(os.environ.get('YTDL_POOL_SIZE', '4')),
+    max_uses=int(os.environ.get('YTDL_POOL_MAX_USES', '200'))
+)
+YTDL_POOL_WARM = os.environ.get('YTDL_POOL_WARM', 'true').lower() in ('1', 'true', 'yes', 'on')
+
+def _extract_with_config(url, name, ydl_opts, process=True, variant=None):
+    """Extract url on a pooled instance of config name, recording the config's health.
+
+    process=False returns the unprocessed result, for callers that select
+    formats themselves. Instances built with extra options are pooled apart
+    under `variant`.
+    """
+    logger.debug(f"Trying configuration {name} for URL: {url}")
+    started = time.monotonic()
+    try:
+        with ydl_pool.lease(f'{name}:{variant}' if variant else name, ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False, process=process)
+    except Exception:
+        extractor_health.record(name, False, time.monotonic() - started)
+        raise
+    extractor_health.record(name, bool(info), time.monotonic() - started)
+    return info
+
+def _extract_sequential(url, configs, process=True, variant=None, raise_error=False):
+    """Try each config in turn and return (info, name) for the first that works.
+
+    Returns (None, None) when they all fail, or raises the last error when
+    raise_error is set.
+    """
+    error = None
+    for name, ydl_opts in configs:
+        try:
+            info = _extract_with_config(url, name, ydl_opts, process=process, variant=variant)
+            if info:
+                return info, name
+        except Exception as e:
+            logger.warning(f"Configuration {name} failed: {str(e)}")
+            error = e
+    if raise_error:
+        raise error or RuntimeError(f"No information extracted for {url}")
+    return None, None
+
+def _extract_unprocessed(url, configs):
+    """Return (info, config name) for url unprocessed, reusing a recent extraction of the video."""
+    cached = extract_cache.get(extract_video_id(url))
+    if cached:
+        logger.debug(f"Extraction cache hit for {cached['info'].get('id')}")
+        return cached['info'], cached['config']
+    info, name = _extract_sequential(url, configs, process=False, raise_error=True)
+    extract_cache.put(extract_video_id(url) or info.get('id'), {'info': info, 'config': name})
+    return info, name
+
+def _extract_racing(url, configs, hedge_delay, process=True):
+    """Race configs and return (info, name) for the first that succeeds.
+
+    The primary config starts immediately; each fallback starts after
+    hedge_delay seconds without an answer, or as soon as a running config
+    fails. Fallbacks that have not started yet are cancelled once a result
+    is in; extractions already running cannot be interrupted, so they finish
+    in the background and their result is discarded. No hedge is started
+    while the extractor pool is saturated; fallbacks then only replace
+    failed configs.
+    """
+    remaining = list(configs)
+    running = {}
+
+    def launch(hedge=False):
+        if hedge and _extractor_pool.saturated:
+            return False
+        name, ydl_opts = remaining.pop(0)
+        running[_extractor_pool.submit(_extract_with_config, url, name, ydl_opts, process)] = name
+        return True
+
+    launch()
+    while remaining and hedge_delay <= 0 and launch(hedge=True):
+        pass
+
+    while running:
+        timeout = hedge_delay if remaining and hedge_delay > 0 else None
+        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            if launch(hedge=True):
+                logger.debug(f"No answer after {hedge_delay}s, hedged with {list(running.values())[-1]}")
+            continue
+        for future in done:
+            name = running.pop(future)
+            try:
+                info = future.result()
+            except Exception as e:
+                logger.warning(f"Configuration {name} failed: {str(e)}")
+                info = None
+            if info:
+                for other in running:
+                    other.cancel()
+                return info, name
+            if remaining:
+                launch()
+    return None, None
+
+def get_video_info(url):
+    """Extract video information without downloading"""
+
+    # Repeat lookups of the same video are answered from memory
+    video_id = extract_video_id(url)
+    cached = metadata_cache.get(video_id)
+    if cached:
+        logger.debug(f"Metadata cache hit for {video_id}")
+        return cached
+    
+    # Try multiple configurations for maximum compatibility, healthiest first.
+    # Results are kept unprocessed so a conversion that follows can reuse them.
+    configs = extractor_health.order(_extractor_configs())
+    # A saturated pool would queue the primary behind other requests'
+    # losing extractions: run the configs in this thread instead
+    if EXTRACTOR_RACE_MODE in ('hedge', 'all') and not _extractor_pool.saturated:
+        hedge_delay = 0 if EXTRACTOR_RACE_MODE == 'all' else EXTRACTOR_HEDGE_DELAY
+        info, name = _extract_racing(url, configs, hedge_delay, process=False)
+    else:
+        info, name = _extract_sequential(url, configs, process=False)
+
+    if info:
+        logger.debug(f"Successfully extracted info with config {name}: {info.get('title', 'Unknown')}")
+        extract_cache.put(video_id or info.get('id'), {'info': info, 'config': name})
+        summary = _summarize_info(info)
+        metadata_cache.put(video_id or summary['id'], summary)
+        return summary
+    
+    logger.error(f"All configurations failed for URL: {url}")
+    return None
+
+class BandwidthShare:
+    """One transfer's slice of the bandwidth budget."""
+
+    __slots__ = ('limit', 'speed', '_apply')
+
+    def __init__(self, apply=None):
+        self.limit = None
+        self.speed = None
+        self._apply = apply
+
+    def set_limit(self, limit):
+        self.limit = limit
+        if self._apply:
+            self._apply(limit)
+
+class BandwidthGovernor:
+    """Splits a process-wide download budget (bytes/s) between active transfers.
+
+    Every transfer gets an equal share. Transfers running well below their
+    share (throttled upstream) leave the rest to those at their limit, so a
+    single transfer can use the whole budget. Limits are re-evaluated when
+    a transfer starts or ends and at most every `interval` seconds otherwise.
+    """
+
+    def __init__(self, total, interval=1.0):
+        self.total = total
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._shares = []
+        self._last_rebalance = 0.0
+
+    @contextmanager
+    def share(self, apply=None):
+        """Yield a BandwidthShare; apply(limit) is called whenever its limit changes."""
+        share = BandwidthShare(apply)
+        if not self.total:
+            yield share
+            return
+        with self._lock:
+            self._shares.append(share)
+            self._rebalance_locked()
+        try:
+            yield share
+        finally:
+            with self._lock:
+                self._shares.remove(share)
+                self._rebalance_locked()
+
+    def report(self, share, speed):
+        """Record the current speed of a transfer."""
+        share.speed = speed
+        if not self.total or time.monotonic() - self._last_rebalance < self.interval:
+            return
+        with self._lock:
+            self._rebalance_locked()
+
+    def _rebalance_locked(self):
+        self._last_rebalance = time.monotonic()
+        if not self._shares:
+            return
+        fair = self.total / len(self._shares)
+        light = [share for share in self._shares if share.speed and share.speed < fair * 0.8]
+        heavy = len(self._shares) - len(light)
+        bonus = sum(fair - share.speed for share in light) / heavy if heavy else 0
+        for share in self._shares:
+            share.set_limit(int(fair if share in light else fair + bonus))
+
+    def throttle(self, share, started, transferred):
+        """Sleep as needed to keep a transfer started at `started` under its limit."""
+        elapsed = time.monotonic() - started
+        if elapsed > 0:
+            self.report(share, transferred / elapsed)
+        if share.limit and transferred:
+            delay = transferred / share.limit - elapsed
+            if delay > 0:
+                time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'total': self.total,
+                'active': len(self._shares),
+                'limits': [share.limit for share in self._shares],
+                'speeds': [round(share.speed) if share.speed else None for share in self._shares]
+            }
+
+# Download bandwidth shared by the transfers of this worker process, in
+# bytes/s (yt-dlp notation such as '20M' accepted; 0 means unlimited)
+bandwidth = BandwidthGovernor(yt_dlp.utils.parse_bytes(os.environ.get('DOWNLOAD_BANDWIDTH_LIMIT', '0')) or 0)
+
+# Parallel connections per download: ranges of a single-file HTTPS source,
+# or fragments of a DASH/HLS format
+CONCURRENT_FRAGMENTS = int(os.environ.get('CONCURRENT_FRAGMENTS', '4'))
+# Sources are not split into ranges smaller than this
+DOWNLOAD_MIN_RANGE = 1024 * 1024
+# Attempts per range before the download fails
+DOWNLOAD_RANGE_RETRIES = 3
+
+class RangeNotSupported(Exception):
+    """Raised when a server answers a ranged request with the whole file."""
+
+def _source_size(ydl, fmt):
+    """Size in bytes of a single-file source, asking the server when the format does not say."""
+    if fmt.get('filesize'):
+        return fmt['filesize']
+    headers = fmt.get('http_headers') or {}
+    try:
+        response = ydl.urlopen(YDLRequest(fmt['url'], headers={**headers, 'Range': 'bytes=0-0'}))
+    except YDLHTTPError:
+        return None
+    with closing(response):
+        match = re.fullmatch(r'bytes 0-0/(\d+)', response.headers.get('Content-Range') or '')
+        return int(match.group(1)) if response.status == 206 and match else None
+
+def _download_ranges(ydl, fmt, path, job, share):
+    """Fetch a single-file HTTP source into path with parallel ranged requests.
+
+    The file is split into CONCURRENT_FRAGMENTS ranges (at most
+    STREAM_RANGE_SIZE bytes each, as YouTube throttles long requests),
+    fetched by as many threads through yt-dlp's HTTP stack. Every thread
+    is throttled against the job's single bandwidth share, so the job as a
+    whole stays within it. Returns False, leaving the download to yt-dlp,
+    when the source cannot be fetched that way.
+    """
+    if CONCURRENT_FRAGMENTS <= 1 or fmt.get('protocol') not in ('http', 'https'):
+        return False
+    total = _source_size(ydl, fmt)
+    if not total:
+        return False
+    headers = fmt.get('http_headers') or {}
+    size = min(STREAM_RANGE_SIZE, max(DOWNLOAD_MIN_RANGE, -(-total // CONCURRENT_FRAGMENTS)))
+    ranges = deque((start, min(start + size, total) - 1) for start in range(0, total, size))
+    tmp_path = f"{path}.part"
+    lock = threading.Lock()
+    stop = threading.Event()
+    hook = ProgressHook(job)
+    downloaded = 0
+    started = time.monotonic()
+
+    def progress(received):
+        nonlocal downloaded
+        with lock:
+            downloaded += received
+            elapsed = time.monotonic() - started
+            speed = downloaded / elapsed if elapsed > 0 else None
+            hook({
+                'status': 'downloading',
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                'speed': speed,
+                'eta': round((total - downloaded) / speed) if speed else None
+            })
+            transferred = downloaded
+        bandwidth.throttle(share, started, transferred)
+
+    def fetch_range(f, start, end):
+        offset, attempts = start, 0
+        while offset <= end and not stop.is_set():
+            try:
+                response = ydl.urlopen(YDLRequest(fmt['url'], headers={**headers, 'Range': f'bytes={offset}-{end}'}))
+                with closing(response):
+                    if response.status != 206:
+                        raise RangeNotSupported(f"HTTP {response.status} for a ranged request")
+                    f.seek(offset)
+                    while offset <= end and not stop.is_set():
+                        chunk = response.read(min(STREAM_CHUNK_SIZE, end - offset + 1))
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        offset += len(chunk)
+                        progress(len(chunk))
+                if offset <= end and not stop.is_set():
+                    raise OSError(f"Connection closed at byte {offset} of range {start}-{end}")
+            except RangeNotSupported:
+                raise
+            except Exception as e:
+                attempts += 1
+                if attempts >= DOWNLOAD_RANGE_RETRIES:
+                    raise
+                logger.debug(f"Retrying range {offset}-{end} after error: {str(e)}")
+                time.sleep(attempts)
+
+    def worker():
+        # One file handle per thread, each writing its ranges in place
+        with open(tmp_path, 'r+b') as f:
+            while not stop.is_set():
+                with lock:
+                    if not ranges:
+                        return
+                    start, end = ranges.popleft()
+                try:
+                    fetch_range(f, start, end)
+                except Exception:
+                    stop.set()
+                    raise
+
+    connections = min(CONCURRENT_FRAGMENTS, len(ranges))
+    with open(tmp_path, 'wb') as f:
+        f.truncate(total)
+    try:
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix='range') as pool:
+            for future in [pool.submit(worker) for _ in range(connections)]:
+                future.result()
+    except RangeNotSupported as e:
+        logger.debug(f"Ranged download unavailable, using yt-dlp: {str(e)}")
+        os.remove(tmp_path)
+        return False
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    hook({'status': 'finished', 'downloaded_bytes': total, 'total_bytes': total, 'filename': path})
+    return True
+
+def _work_dir_prefix(key):
+    """Leading part of the name of every work directory created for key."""
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def _download_stage(url, job):
+    """Download the source audio for a job (I/O stage).
+
+    Returns (info, source_path), or (None, file_path) when the output cache
+    already holds the converted file.
+    """
+    # Serve straight from the output cache when this video was already converted
+    with job.span('output_lookup'):
+        cached = output_cache.get(extract_video_id(url), job.output_format, site='job')
+    if cached:
+        logger.debug(f"Output cache hit for {cached['video_id']}: {cached['file_path']}")
+        job.publish(_cached_progress(cached))
+        return None, cached['file_path']
+
+    # Sources go to a per-job work directory so jobs for the same video, in
+    # different formats or in different worker processes, never write to
+    # the same path
+    work_dir = os.path.join(
+        DOWNLOADS_DIR, '.work',
+        f"{_work_dir_prefix(job.key)}-{os.getpid()}-{os.urandom(3).hex()}"
+    )
+    os.makedirs(work_dir, exist_ok=True)
+    job.paths.add(work_dir)
+    
+    # Detect ffmpeg location if available (Hostinger/shared hosting friendly)
+    ffmpeg_path = _detect_ffmpeg_path()
+    
+    job.publish({
+        'status': 'starting',
+        'stage': 'starting',
+        'percent': 0,
+        'stage_percent': 0
+    })
+
+    # Extract info first on a warm instance, healthiest config first (iOS by
+    # default), unprocessed so the download below reuses it; a recent
+    # /validate or /api/info of the same video already did it
+    with job.span('extract'):
+        info, config_name = _extract_unprocessed(url, extractor_health.order(_extractor_configs()))
+    video_id = info.get('id')
+
+    # Transcoding is left to the transcode stage, so no post-processors here
+    ydl_opts = {
+        'format': OUTPUT_FORMATS[job.output_format]['selector'],
+        'outtmpl': os.path.join(work_dir, '%(title)s [%(id)s].%(ext)s'),
+        # Use custom ffmpeg if provided
+        **({ 'ffmpeg_location': ffmpeg_path } if ffmpeg_path else {}),
+        'progress_hooks': [ProgressHook(job)],
+        # Fragment threads each apply 'ratelimit' on their own, from a copy
+        # of the params taken when the download starts: with a budget, one
+        # thread keeps the format within its share
+        'concurrent_fragment_downloads': 1 if bandwidth.total else CONCURRENT_FRAGMENTS,
+        **dict(_extractor_configs())[config_name],
+        'quiet': False,
+        'no_warnings': False,
+    }
+
+    # The URL may not carry a recognisable ID (e.g. redirects), check again
+    if video_id != extract_video_id(url):
+        with job.span('output_lookup'):
+            cached = output_cache.get(video_id, job.output_format, site='job')
+        if cached:
+            logger.debug(f"Output cache hit for {video_id}: {cached['file_path']}")
+            job.publish(_cached_progress(cached))
+            return None, cached['file_path']
+
+    # Format selection, output template and progress hooks are per job, so
+    # the download runs on its own instance. Single-file HTTPS sources are
+    # fetched in parallel ranges; other formats go through yt-dlp, which
+    # reads 'ratelimit' from its params on every block of a plain HTTP
+    # download, so the governor can adjust it mid-download.
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl, \
+            bandwidth.share(lambda limit: ydl.params.__setitem__('ratelimit', limit)) as share:
+        ydl.add_progress_hook(lambda d: d.get('speed') and bandwidth.report(share, d['speed']))
+        # Select the format without a second extraction round-trip
+        started = time.monotonic()
+        with job.span('download'):
+            try:
+                info = ydl.process_ie_result(info, download=False)
+                source_path = ydl.prepare_filename(info)
+                if info.get('requested_formats') or not _download_ranges(ydl, info, source_path, job, share):
+                    ydl.process_info(info)
+            except Exception:
+                # The cached stream URLs may be what failed: extract afresh next time
+                extract_cache.discard(extract_video_id(url) or video_id)
+                raise
+        metadata_cache.put(video_id, _summarize_info(info))
+
+        if not os.path.exists(source_path):
+            raise RuntimeError(f"Downloaded file not found: {source_path}")
+        metrics.observe('ytconv_download_seconds', time.monotonic() - started)
+        metrics.inc('ytconv_download_bytes_total', os.path.getsize(source_path))
+        return info, source_path
+
+def _can_remux(info, output_format):
+    """Whether the downloaded audio already uses the codec of output_format."""
+    acodec = (info.get('acodec') or '').lower()
+    return any(acodec.startswith(codec) for codec in OUTPUT_FORMATS[output_format]['source_codecs'])
+
+class FFmpegGovernor:
+    """Core-based budget for FFmpeg processes, shared by file conversions and streams.
+
+    At most `max_processes` FFmpeg processes run at once, each limited to
+    `threads` threads and started with `nice` added to its niceness, so
+    request threads keep some CPU during bursts of conversions.
+    """
+
+    def __init__(self, max_processes, threads=1, nice=0):
+        self.max_processes = max(1, max_processes)
+        self.threads = max(1, threads)
+        self.nice = nice
+        self._slots = threading.BoundedSemaphore(self.max_processes)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+
+    def acquire(self, blocking=True):
+        """Take a process slot; returns False when blocking is off and none is free."""
+        with self._lock:
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(blocking=blocking)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                if acquired:
+                    self.active += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+    def thread_args(self):
+        return ['-threads', str(self.threads)]
+
+    def popen(self, cmd, **kwargs):
+        """Start FFmpeg with the governor's scheduling priority."""
+        proc = subprocess.Popen(cmd, **kwargs)
+        if self.nice and hasattr(os, 'setpriority'):
+            # Set from the parent rather than a preexec_fn, which is not
+            # safe to use from a threaded server
+            try:
+                os.setpriority(os.PRIO_PROCESS, proc.pid, min(19, os.getpriority(os.PRIO_PROCESS, 0) + self.nice))
+            except OSError as e:
+                logger.debug(f"Could not lower FFmpeg priority: {str(e)}")
+        return proc
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_processes': self.max_processes,
+                'threads': self.threads,
+                'nice': self.nice,
+                'active': self.active,
+                'waiting': self.waiting
+            }
+
+# Defaults: one FFmpeg per core, one thread each (audio encoders barely
+# use more), slightly lower priority than the web workers
+FFMPEG_MAX_PROCESSES = int(os.environ.get('FFMPEG_MAX_PROCESSES', str(os.cpu_count() or 1)))
+ffmpeg_governor = FFmpegGovernor(
+    FFMPEG_MAX_PROCESSES,
+    threads=int(os.environ.get('FFMPEG_THREADS', str(max(1, (os.cpu_count() or 1) // max(1, FFMPEG_MAX_PROCESSES))))),
+    nice=int(os.environ.get('FFMPEG_NICE', '10'))
+)
+
+@metrics.collector
+def _ffmpeg_metrics():
+    stats = ffmpeg_governor.stats()
+    return [
+        ('ytconv_ffmpeg_processes', {}, stats['active']),
+        ('ytconv_ffmpeg_waiting', {}, stats['waiting'])
+    ]
+
+def _encoder_args(output_format=AUDIO_CODEC, remux=False, streaming=False):
+    """FFmpeg output options producing output_format, by stream copy when remux is set."""
+    settings = OUTPUT_FORMATS[output_format]
+    codec_args = ['-c:a', 'copy'] if remux else settings['encoder']
+    return ['-vn', *codec_args, *ffmpeg_governor.thread_args(), *settings['stream_muxer' if streaming else 'muxer']]
+
+def _transcode(source_path, output_path, duration, job, remux=False):
+    """Encode (or remux) source_path to output_path with FFmpeg, reporting stage progress."""
+    # Unique per job: another worker may be producing the same output
+    tmp_path = f"{output_path}.{os.getpid()}-{os.urandom(3).hex()}.part"
+    job.paths.add(tmp_path)
+    cmd = [
+        _detect_ffmpeg_path() or 'ffmpeg',
+        '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+        '-i', source_path,
+        *_encoder_args(job.output_format, remux=remux),
+        '-progress', 'pipe:1', '-nostats',
+        tmp_path
+    ]
+    proc = ffmpeg_governor.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # Drain stderr concurrently so a chatty FFmpeg cannot block on a full pipe
+    stderr_lines = deque(maxlen=20)
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(proc.stderr), daemon=True)
+    stderr_thread.start()
+    for line in proc.stdout:
+        key, _, value = line.strip().partition('=')
+        if key in ('out_time_us', 'out_time_ms') and duration and value.isdigit():
+            stage_percent = min(100.0, int(value) / 1e6 / duration * 100)
+            _publish_stage(job, 'transcode', stage_percent)
+        elif key == 'total_size' and value.isdigit():
+            job.tick({'output_bytes': int(value)})
+    proc.wait()
+    stderr_thread.join()
+    if proc.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise RuntimeError(f"FFmpeg failed ({proc.returncode}): {''.join(stderr_lines).strip()}")
+    os.replace(tmp_path, output_path)
+
+def _transcode_stage(job, info, source_path, queued_at):
+    """Encode a downloaded source to the output codec (CPU stage) and finish the job."""
+    ffmpeg_governor.acquire()
+    job.record_span('transcode_queue', time.monotonic() - queued_at)
+    try:
+        _publish_stage(job, 'transcode', 0)
+        output_format = job.output_format
+        base_name = os.path.splitext(os.path.basename(source_path))[0]
+        output_path = os.path.join(DOWNLOADS_DIR, f"{base_name}.{output_format}")
+        job.paths.add(output_path)
+        remux = _can_remux(info, output_format)
+        if remux:
+            logger.debug(f"Remuxing {info.get('acodec')} source to {output_format} without re-encoding")
+        started = time.monotonic()
+        with job.span('transcode'):
+            _transcode(source_path, output_path, info.get('duration'), job, remux=remux)
+        metrics.observe('ytconv_transcode_seconds', time.monotonic() - started,
+                        format=output_format, mode='remux' if remux else 'encode')
+
+        title = info.get('title', 'unknown')
+        with job.span('finalize'):
+            shutil.rmtree(os.path.dirname(source_path), ignore_errors=True)
+            output_cache.put(info.get('id'), output_path, title, codec=output_format)
+        job.publish({
+            'status': 'completed',
+            'percent': 100,
+            'file_path': output_path,
+            'filename': f"{title}.{output_format}",
+            'remuxed': remux
+        })
+        job.result = output_path
+    except Exception as e:
+        _fail_job(job, e)
+    finally:
+        ffmpeg_governor.release()
+        scheduler.finish_transcode()
+        _release_job(job)
+
+def _publish_stage(job, stage, stage_percent, **telemetry):
+    """Report progress for a pipeline stage, scaled into the overall percentage.
+
+    Entering a stage writes a full record; progress within a stage goes
+    through the job's rate-limited tick.
+    """
+    if stage == 'download':
+        percent = stage_percent * DOWNLOAD_STAGE_SHARE / 100
+        status = 'downloading'
+    else:
+        percent = DOWNLOAD_STAGE_SHARE + stage_percent * (100 - DOWNLOAD_STAGE_SHARE) / 100
+        status = 'processing'
+    fields = {'percent': round(percent, 1), 'stage_percent': round(stage_percent, 1), **telemetry}
+    if job.stage == stage:
+        job.tick(fields)
+    else:
+        job.publish({'status': status, 'stage': stage, **fields})
+
+def _fail_job(job, error):
+    logger.error(f"Error during conversion: {str(error)}")
+    metrics.inc('ytconv_errors_total', stage=job.stage or 'download', error=type(error).__name__)
+    job.publish({
+        'status': 'error',
+        'percent': 0,
+        'error': f'Erreur: {str(error)}'
+    })
+
+def _release_job(job):
+    """Let requests waiting on a job go and allow new jobs for the same key."""
+    with _inflight_lock:
+        _inflight_jobs.pop(job.key, None)
+    if job.claimed:
+        try:
+            conversion_progress.release_claim(job.key, job.progress_ids[0])
+        except sqlite3.Error as e:
+            # The claim then lapses after JOB_CLAIM_TTL
+            logger.warning(f"Could not release claim of {job.key}: {e}")
+    # No one can attach any more: index the output under every follower's ID
+    record = job.last_record
+    if job.result and record:
+        output_cache.link(job.progress_ids, job.result, record.get('filename'))
+    # One structured line per job, to find the slow stage without a profiler
+    logger.info("Conversion timings " + json.dumps({
+        'key': job.key,
+        'status': record.get('status') if record else None,
+        'followers': len(job.progress_ids),
+        'total': round(time.time() - job.started_at, 3),
+        'timings': job.timings
+    }))
+    job.done.set()
+
+# Streaming conversion: the source is fed to FFmpeg and the encoded output
+# is sent to the client as it is produced, without touching the disk.
+STREAM_CHUNK_SIZE = 64 * 1024
+# Source is fetched in ranges, as YouTube throttles long single requests
+STREAM_RANGE_SIZE = 10 * 1024 * 1024
+_stream_slots = threading.BoundedSemaphore(int(os.environ.get('STREAM_MAX_CONCURRENT', str(os.cpu_count() or 1))))
+
+def _feed_stream(ydl, fmt, sink, stop):
+    """Copy the source audio into FFmpeg's stdin through yt-dlp's HTTP stack."""
+    headers = fmt.get('http_headers') or {}
+    total = fmt.get('filesize')
+    offset = 0
+    started = time.monotonic()
+    try:
+        with bandwidth.share() as share:
+            while not stop.is_set() and not (total and offset >= total):
+                end = offset + STREAM_RANGE_SIZE - 1
+                if total:
+                    end = min(end, total - 1)
+                requested = end - offset + 1
+                try:
+                    response = ydl.urlopen(YDLRequest(fmt['url'], headers={**headers, 'Range': f'bytes={offset}-{end}'}))
+                except YDLHTTPError as e:
+                    if e.status == 416:
+                        break
+                    raise
+                received = 0
+                while not stop.is_set():
+                    chunk = response.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sink.write(chunk)
+                    received += len(chunk)
+                    bandwidth.throttle(share, started, offset + received)
+                offset += received
+                if received < requested:
+                    # Short read: the source has no more data
+                    break
+    except (BrokenPipeError, ValueError):
+        # FFmpeg went away (client disconnected); nothing left to feed
+        pass
+    except Exception as e:
+        logger.error(f"Stream feeder error: {str(e)}")
+    finally:
+        try:
+            sink.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+def _open_stream(url, output_format=AUDIO_CODEC):
+    """Start a streaming conversion and return (ydl, info, proc, feeder, stop)."""
+    info, config_name = _extract_unprocessed(url, extractor_health.order(_extractor_configs()))
+    # This instance stays with the stream to fetch the source
+    ydl = yt_dlp.YoutubeDL({**dict(_extractor_configs())[config_name], 'format': OUTPUT_FORMATS[output_format]['selector']})
+    try:
+        info = ydl.process_ie_result(info, download=False)
+        metadata_cache.put(info.get('id'), _summarize_info(info))
+        fmt = (info.get('requested_formats') or [info])[0]
+
+        cmd = [_detect_ffmpeg_path() or 'ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error']
+        direct = fmt.get('protocol') in ('http', 'https')
+        if direct:
+            cmd += ['-i', 'pipe:0']
+        else:
+            # HLS and other protocols are left to FFmpeg's own demuxers
+            headers = ''.join(f'{k}: {v}\r\n' for k, v in (fmt.get('http_headers') or {}).items())
+            cmd += ['-headers', headers, '-i', fmt['url']]
+        cmd += [*_encoder_args(output_format, remux=_can_remux(fmt, output_format), streaming=True), 'pipe:1']
+        proc = ffmpeg_governor.popen(
+            cmd,
+            stdin=subprocess.PIPE if direct else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        stop = threading.Event()
+        feeder = None
+        if direct:
+            feeder = threading.Thread(target=_feed_stream, args=(ydl, fmt, proc.stdin, stop), daemon=True)
+            feeder.start()
+        return ydl, info, proc, feeder, stop
+    except Exception:
+        ydl.close()
+        raise
+
+def _join_or_start_job(url, progress_id, output_format=AUDIO_CODEC):
+    """Attach progress_id to the in-flight job for this video, creating it if needed.
+
+    Returns (job, is_leader); only the leader runs the conversion.
+    """
+    video_id = extract_video_id(url)
+    quality = OUTPUT_FORMATS[output_format]['quality']
+    key = OutputCache.make_key(video_id or url, output_format, quality)
+    with _inflight_lock:
+        job = _inflight_jobs.get(key)
+        if job is not None:
+            job.attach(progress_id)
+            logger.debug(f"Joined in-flight conversion {key} as {progress_id}")
+            return job, False
+        job = ConversionJob(key, progress_id, output_format)
+        _inflight_jobs[key] = job
+    # Record the job right away so status polls never see it as unknown
+    job.publish({'status': 'queued', 'percent': 0})
+    return job, True
 
-# Base path for subdirectory deployments (e.g., /yt)
-BASE_PATH = os.environ.get("BASE_PATH", "").strip()
-if BASE_PATH and not BASE_PATH.startswith("/"):
-    BASE_PATH = f"/{BASE_PATH}"
+def _claim_job(job):
+    """Claim job.key in the job store, following the worker that holds it if any.
 
-# Create Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+    Returns True when this worker should run the job. Otherwise the job has
+    been finished from the other worker's record and released.
+    """
+    owner = job.progress_ids[0]
+    leader = conversion_progress.claim(job.key, owner, JOB_CLAIM_TTL)
+    version, mirrored = -1, None
+    while leader != owner:
+        record = conversion_progress.get(leader)
+        if record is None or time.time() - record.get('updated_at', 0) > JOB_CLAIM_STALE:
+            logger.info(f"Taking over stalled conversion {job.key} from {leader}")
+            leader = conversion_progress.claim(job.key, owner, JOB_CLAIM_TTL, stale_owner=leader)
+            continue
+        fields = {k: v for k, v in record.items() if k not in ('started_at', 'updated_at', 'timings')}
+        if fields != mirrored:
+            job.publish(fields)
+            mirrored = fields
+        if record.get('status') in ('completed', 'error'):
+            if record['status'] == 'completed':
+                job.result = record.get('file_path')
+            _release_job(job)
+            return False
+        # Woken by the other worker's writes only through the timeout
+        version = conversion_progress.wait_for_change(leader, version, 1.0)
+    job.claimed = True
+    return True
 
-# Enable CORS when serving API for a static site on another domain
-if os.environ.get("ENABLE_CORS", "false").lower() in ("1", "true", "yes") and _CORS_AVAILABLE:
-    origins = os.environ.get("CORS_ORIGINS", "*")
+def _lead_job(url, job):
+    """Run a job's download stage and hand the result to the transcode stage."""
+    job.record_span('queue', time.time() - job.started_at)
+    release = True
     try:
-        CORS(app, resources={r"/*": {"origins": origins}})
-    except Exception:
-        pass
+        if not _claim_job(job):
+            # Finished from the other worker's record and already released
+            release = False
+            return
+        info, path = _download_stage(url, job)
+        if info is None:
+            job.result = path
+            return
+        job.publish({
+            'status': 'processing',
+            'stage': 'transcode_queue',
+            'percent': DOWNLOAD_STAGE_SHARE,
+            'stage_percent': 0
+        })
+        scheduler.start_transcode(_transcode_stage, job, info, path, time.monotonic())
+        # From here on the transcode stage releases the job
+        release = False
+    except Exception as e:
+        _fail_job(job, e)
+    finally:
+        if release:
+            _release_job(job)
 
-# Global dictionary to store conversion progress
-conversion_progress = {}
+def _submit_job(url, job, block=False):
+    """Hand a new job to the scheduler, releasing it if the queue is full."""
+    try:
+        scheduler.submit(url, job, block=block)
+    except QueueFullError as e:
+        try:
+            metrics.inc('ytconv_errors_total', stage='queue', error=type(e).__name__)
+            job.publish({
+                'status': 'error',
+                'percent': 0,
+                'error': 'Serveur occupé, veuillez réessayer dans quelques instants.'
+            })
+        finally:
+            _release_job(job)
+        raise
 
-class ProgressHook:
-    def __init__(self, progress_id):
-        self.progress_id = progress_id
-        
-    def __call__(self, d):
-        if d['status'] == 'downloading':
-            if 'total_bytes' in d and d['total_bytes']:
-                percent = (d['downloaded_bytes'] / d['total_bytes']) * 100
-            elif 'total_bytes_estimate' in d and d['total_bytes_estimate']:
-                percent = (d['downloaded_bytes'] / d['total_bytes_estimate']) * 100
-            else:
-                percent = 0
-            
-            conversion_progress[self.progress_id] = {
-                'status': 'downloading',
-                'percent': round(percent, 1),
-                'message': f'Téléchargement... {round(percent, 1)}%'
-            }
-        elif d['status'] == 'finished':
-            conversion_progress[self.progress_id] = {
-                'status': 'processing',
-                'percent': 90,
-                'message': 'Conversion en cours...'
-            }
+def start_conversion(url, progress_id, output_format=AUDIO_CODEC, block=False):
+    """Queue (or join) the conversion for url and return its job without waiting.
 
-def normalize_url(url: str) -> str:
-    url = url.strip()
-    if not re.match(r'^https?://', url):
-        url = 'https://' + url
-    return url
+    Raises QueueFullError when the scheduler cannot take the job, unless
+    block is set, in which case it waits for room in the queue.
+    """
+    job, is_leader = _join_or_start_job(url, progress_id, output_format)
+    if is_leader:
+        _submit_job(url, job, block=block)
+    return job
 
-def is_valid_youtube_url(url: str) -> bool:
-    """Validate if the URL is a valid YouTube or youtu.be URL, including Shorts."""
-    try:
-        url = normalize_url(url)
-        parsed = urlparse(url)
-        host = parsed.netloc.lower()
-        path = parsed.path.rstrip('/')
-        qs = parse_qs(parsed.query)
+def download_and_convert(url, progress_id, output_format=AUDIO_CODEC):
+    """Download and convert YouTube video to MP3 (or m4a/opus), sharing work with identical requests.
 
-        if 'youtube.com' in host or 'youtu.be' in host or 'm.youtube.com' in host:
-            # youtu.be shortlinks: path contains the ID
-            if 'youtu.be' in host:
-                return bool(path.strip('/'))
+    Blocks until the conversion is finished; raises QueueFullError when the
+    scheduler cannot take the job.
+    """
+    job = start_conversion(url, progress_id, output_format)
+    job.done.wait()
+    return job.result
 
-            # youtube.com paths
-            p = path.lower()
-            if p.startswith('/watch'):
-                return 'v' in qs and len(qs.get('v', [''])[0]) > 0
-            if p.startswith('/shorts/'):
-                return len(p.split('/shorts/', 1)[-1]) > 0
-            if p.startswith('/embed/') or p.startswith('/v/') or p.startswith('/live/'):
-                return True
-            # Accept music.youtube.com/watch?v=...
-            if p == '/watch' and 'v' in qs:
-                return True
-        return False
-    except Exception:
-        return False
+class StorageJanitor:
+    """Background thread keeping downloads/ under a byte budget and a maximum age.
 
-def get_video_info(url):
-    """Extract video information without downloading"""
-    
-    # Try multiple configurations for maximum compatibility
-    cookies_file = _resolve_cookies_file()
-    common_headers = {
-        'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Mobile/15E148 Safari/604.1',
-        'Accept-Language': os.environ.get('ACCEPT_LANGUAGE', 'en-US,en;q=0.9,fr-FR;q=0.8')
-    }
+    Converted files are evicted least recently used first; leftover work
+    directories and .part files are removed once they stop changing. Paths
+    held by in-flight jobs of this process are never touched, nor are the
+    work directories of conversions claimed in the job store (jobs of other
+    worker processes, possibly waiting for a transcode slot). Nothing
+    modified within `grace` seconds is removed.
+    """
 
-    configs = [
-        # Configuration 1: Most compatible
-        {
-            'quiet': True,
-            'no_warnings': True,
-            'http_headers': common_headers,
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['ios'],
-                    'skip': ['dash', 'hls']
-                }
-            },
-            **({'cookiefile': cookies_file} if cookies_file else {})
-        },
-        # Configuration 2: Android fallback
-        {
-            'quiet': True,
-            'no_warnings': True,
-            'http_headers': {**common_headers, 'User-Agent': 'com.google.android.youtube/19.09.36 (Linux; U; Android 11) gzip'},
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android'],
-                    'skip': ['dash']
-                }
-            },
-            **({'cookiefile': cookies_file} if cookies_file else {})
-        },
-        # Configuration 3: Basic web fallback
-        {
-            'quiet': True,
-            'no_warnings': True,
-            'http_headers': {**common_headers, 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
-            **({'cookiefile': cookies_file} if cookies_file else {})
-        },
-    ]
-    
-    for i, ydl_opts in enumerate(configs):
+    def __init__(self, directory, max_bytes, max_age, interval, grace):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._thread = None
+        self.usage_bytes = 0
+        self.file_count = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.last_run = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='storage-janitor', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Storage janitor error: {str(e)}")
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _in_use():
+        with _inflight_lock:
+            jobs = list(_inflight_jobs.values())
+        return set().union(*(job.paths for job in jobs)) if jobs else set()
+
+    @staticmethod
+    def _tree_stats(path):
+        """Total size and newest mtime of a directory tree."""
+        size, newest = 0, os.path.getmtime(path)
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                size += st.st_size
+                newest = max(newest, st.st_mtime)
+        return size, newest
+
+    def _remove(self, path, size):
         try:
-            logger.debug(f"Trying configuration {i+1} for URL: {url}")
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                if info:
-                    logger.debug(f"Successfully extracted info with config {i+1}: {info.get('title', 'Unknown')}")
-                    
-                    return {
-                        'title': info.get('title', 'Titre non disponible'),
-                        'duration': info.get('duration', 0),
-                        'uploader': info.get('uploader', 'Inconnu'),
-                        'view_count': info.get('view_count', 0),
-                        'thumbnail': info.get('thumbnail', ''),
-                        'id': info.get('id', '')
-                    }
-                    
-        except Exception as e:
-            logger.warning(f"Configuration {i+1} failed: {str(e)}")
-            continue
-    
-    logger.error(f"All configurations failed for URL: {url}")
-    return None
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+            return False
+        with self._lock:
+            self.evictions += 1
+            self.evicted_bytes += size
+        logger.debug(f"Janitor removed {path} ({size} bytes)")
+        return True
 
-def download_and_convert(url, progress_id):
-    """Download and convert YouTube video to MP3"""
-    try:
-        # Create downloads directory if it doesn't exist
-        downloads_dir = os.path.join(os.getcwd(), 'downloads')
-        os.makedirs(downloads_dir, exist_ok=True)
-        
-        # Detect ffmpeg location if available (Hostinger/shared hosting friendly)
-        ffmpeg_path = _detect_ffmpeg_path()
-        
-        # Configure yt-dlp options with iOS client for better compatibility
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': os.path.join(downloads_dir, '%(title)s.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            # Use custom ffmpeg if provided
-            **({ 'ffmpeg_location': ffmpeg_path } if ffmpeg_path else {}),
-            'progress_hooks': [ProgressHook(progress_id)],
-            'quiet': False,
-            'no_warnings': False,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Mobile/15E148 Safari/604.1',
-                'Accept-Language': os.environ.get('ACCEPT_LANGUAGE', 'en-US,en;q=0.9,fr-FR;q=0.8')
-            },
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['ios'],
-                    'skip': ['dash', 'hls']
-                }
-            },
-            **({'cookiefile': _resolve_cookies_file()} if _resolve_cookies_file() else {})
-        }
-        
-        conversion_progress[progress_id] = {
-            'status': 'starting',
-            'percent': 0,
-            'message': 'Initialisation...'
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Extract info first
-            info = ydl.extract_info(url, download=False)
-            title = info.get('title', 'unknown')
-            
-            # Start download
-            ydl.download([url])
-            
-            # Find the downloaded MP3 file
-            mp3_file = None
-            
-            # Look for the most recently created MP3 file
-            mp3_files = []
-            for file in os.listdir(downloads_dir):
-                if file.endswith('.mp3'):
-                    file_path = os.path.join(downloads_dir, file)
-                    mp3_files.append((file_path, os.path.getctime(file_path)))
-            
-            if mp3_files:
-                # Sort by creation time and get the most recent
-                mp3_files.sort(key=lambda x: x[1], reverse=True)
-                mp3_file = mp3_files[0][0]
-            
-            if not mp3_file or not os.path.exists(mp3_file):
-                # Fallback: look for any mp3 file that might match the title
-                safe_title = re.sub(r'[^\w\s-]', '', title).strip().lower()
-                for file in os.listdir(downloads_dir):
-                    if file.endswith('.mp3'):
-                        file_lower = file.lower()
-                        # Check if any words from the title are in the filename
-                        title_words = safe_title.split()
-                        if any(word in file_lower for word in title_words if len(word) > 3):
-                            mp3_file = os.path.join(downloads_dir, file)
-                            break
-            
-            conversion_progress[progress_id] = {
-                'status': 'completed',
-                'percent': 100,
-                'message': 'Conversion terminée!',
-                'file_path': mp3_file,
-                'filename': os.path.basename(mp3_file)
+    def sweep(self):
+        """Run one eviction pass."""
+        if not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        in_use = self._in_use()
+        last_access = output_cache.last_access()
+        removed_files = []
+        leftovers, outputs = [], []
+
+        work_root = os.path.join(self.directory, '.work')
+        if os.path.isdir(work_root):
+            try:
+                claimed = tuple(_work_dir_prefix(key) for key in conversion_progress.claimed_keys())
+            except sqlite3.Error as e:
+                # Without the claims no work directory can be known to be free
+                logger.warning(f"Janitor could not read job claims: {e}")
+                claimed = None
+            for entry in os.scandir(work_root):
+                if claimed is None or entry.name.startswith(claimed):
+                    continue
+                try:
+                    size, newest = self._tree_stats(entry.path)
+                except OSError:
+                    continue
+                leftovers.append((entry.path, size, newest))
+
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            st = entry.stat()
+            if entry.name.endswith(('.part', '.tmp', '.ytdl')):
+                leftovers.append((entry.path, st.st_size, st.st_mtime))
+            else:
+                outputs.append((entry.path, st.st_size, st.st_mtime, max(st.st_mtime, last_access.get(entry.path, 0))))
+
+        for path, size, mtime in leftovers:
+            if path not in in_use and now - mtime > self.grace:
+                self._remove(path, size)
+
+        # Least recently used first
+        outputs.sort(key=lambda item: item[3])
+        usage = sum(item[1] for item in outputs)
+        kept = len(outputs)
+        for path, size, mtime, used in outputs:
+            if path in in_use or now - mtime <= self.grace:
+                continue
+            expired = self.max_age and now - used > self.max_age
+            over_budget = self.max_bytes and usage > self.max_bytes
+            if not (expired or over_budget):
+                continue
+            if self._remove(path, size):
+                removed_files.append(path)
+                usage -= size
+                kept -= 1
+
+        output_cache.forget(removed_files)
+        ytdl_cache.maintain()
+        with self._lock:
+            self.usage_bytes = usage
+            self.file_count = kept
+            self.last_run = now
+
+    def stats(self):
+        with self._lock:
+            return {
+                'usage_bytes': self.usage_bytes,
+                'file_count': self.file_count,
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+                'last_run': self.last_run
             }
-            
-            return mp3_file
-            
-    except Exception as e:
-        logger.error(f"Error during conversion: {str(e)}")
-        conversion_progress[progress_id] = {
-            'status': 'error',
-            'percent': 0,
-            'message': f'Erreur: {str(e)}'
-        }
-        return None
+
+janitor = StorageJanitor(
+    DOWNLOADS_DIR,
+    max_bytes=int(os.environ.get('DOWNLOADS_MAX_BYTES', str(2 * 1024 ** 3))),
+    max_age=int(os.environ.get('DOWNLOADS_MAX_AGE', str(7 * 24 * 3600))),
+    interval=int(os.environ.get('JANITOR_INTERVAL', '300')),
+    grace=int(os.environ.get('JANITOR_GRACE', '600'))
+)
+
+def _prepare_ytdl_cache():
+    """Check the yt-dlp cache and optionally fill it, in the background at startup."""
+    ytdl_cache.maintain()
+    ytdl_cache.prewarm(os.environ.get('YTDL_CACHE_PREWARM_URL', '').strip(), _extractor_configs()[0][1])
+
+if ytdl_cache.enabled:
+    threading.Thread(target=_prepare_ytdl_cache, name='ytdl-cache', daemon=True).start()
+
+_pool_warm_started = threading.Event()
+
+def _warm_ydl_pool():
+    """Warm the yt-dlp pool once per worker, off the request thread."""
+    if not YTDL_POOL_WARM or _pool_warm_started.is_set():
+        return
+    _pool_warm_started.set()
+    threading.Thread(target=ydl_pool.warm, args=(_extractor_configs(),), name='ydl-warm', daemon=True).start()
+
+@app.before_request
+def _start_background_threads():
+    # Started on first request so each forked worker gets its own thread
+    janitor.start()
+    metrics.start()
+    _warm_ydl_pool()
 
 @app.route('/')
 def index():
@@ -362,17 +2812,35 @@ def convert_video():
         
         if not url or not is_valid_youtube_url(url):
             return jsonify({'error': 'URL YouTube invalide'}), 400
+
+        output_format = _requested_format(data)
+        if not output_format:
+            return jsonify({'error': 'Format non pris en charge (mp3, m4a, opus)'}), 400
             
         # Generate unique progress ID
-        progress_id = f"conv_{int(time.time())}_{hash(url) % 10000}"
+        progress_id = f"conv_{int(time.time())}_{os.urandom(3).hex()}"
+
+        # Already converted: no need to start a worker
+        cached = output_cache.get(extract_video_id(url), output_format)
+        if cached:
+            record = _cached_progress(cached)
+            conversion_progress[progress_id] = record
+            output_cache.link([progress_id], cached['file_path'], record['filename'])
+            return jsonify({
+                'progress_id': progress_id,
+                'message': 'Conversion terminée!',
+                'cached': True
+            })
         
-        # Start conversion in background thread
-        thread = threading.Thread(
-            target=download_and_convert, 
-            args=(url, progress_id)
-        )
-        thread.daemon = True
-        thread.start()
+        # Queue the conversion, unless the same video is already converting
+        job, is_leader = _join_or_start_job(url, progress_id, output_format)
+        if is_leader:
+            try:
+                _submit_job(url, job)
+            except QueueFullError:
+                response = jsonify({'error': 'Serveur occupé, veuillez réessayer dans quelques instants.'})
+                response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+                return response, 429
         
         return jsonify({
             'progress_id': progress_id,
@@ -388,16 +2856,101 @@ def get_progress(progress_id):
     """Get conversion progress"""
     progress = conversion_progress.get(progress_id, {
         'status': 'not_found',
-        'percent': 0,
-        'message': 'Conversion non trouvée'
+        'percent': 0
     })
-    return jsonify(progress)
+    return jsonify(_progress_view(progress))
+
+# Server-Sent Events progress stream settings
+SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL', '1.0'))
+SSE_KEEPALIVE = 15
+SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', '600'))
+# Seconds an unknown ID is watched before its stream ends, as with a
+# per-process job store the job may belong to another worker
+SSE_NOT_FOUND_GRACE = float(os.environ.get('SSE_NOT_FOUND_GRACE', '10'))
+
+@app.route('/progress/<progress_id>/stream')
+def stream_progress(progress_id):
+    """Push conversion progress as Server-Sent Events until it completes, fails or is unknown"""
+    def generate():
+        started = last_sent_at = time.monotonic()
+        version = -1
+        last_payload = None
+        # A shared store sees every worker's jobs, so unknown there means unknown
+        not_found_grace = 0 if isinstance(conversion_progress, SQLiteJobStore) else SSE_NOT_FOUND_GRACE
+        not_found_since = None
+        yield 'retry: 2000\n\n'
+        while time.monotonic() - started < SSE_MAX_DURATION:
+            progress = conversion_progress.get(progress_id, {
+                'status': 'not_found',
+                'percent': 0
+            })
+            payload = json.dumps(_progress_view(progress))
+            if payload != last_payload:
+                yield f'data: {payload}\n\n'
+                last_payload = payload
+                last_sent_at = time.monotonic()
+            elif time.monotonic() - last_sent_at >= SSE_KEEPALIVE:
+                yield ': keepalive\n\n'
+                last_sent_at = time.monotonic()
+            if progress['status'] in ('completed', 'error'):
+                return
+            # An unknown ID will not appear later: end the stream rather
+            # than hold a server thread for SSE_MAX_DURATION
+            if progress['status'] == 'not_found':
+                not_found_since = not_found_since or time.monotonic()
+                if time.monotonic() - not_found_since >= not_found_grace:
+                    return
+            else:
+                not_found_since = None
+            # Woken by updates from this process; the timeout picks up
+            # updates written by other workers to a shared job store
+            version = conversion_progress.wait_for_change(progress_id, version, SSE_POLL_INTERVAL)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Hand file bodies to the front proxy instead of streaming them from Python:
+# 'x-accel' (nginx, internal location DOWNLOAD_ACCEL_PREFIX aliased to
+# downloads/) or 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', '').strip().lower()
+DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/_protected_downloads/')
+DOWNLOAD_MAX_AGE = int(os.environ.get('DOWNLOAD_MAX_AGE', '3600'))
+
+def _file_etag(file_path, st):
+    """Strong ETag for a converted file: its name (video ID and format), size and mtime."""
+    identity = f"{os.path.basename(file_path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:32]
+
+def _offloaded_file_response(file_path, download_name, mimetype, st, etag):
+    """Empty response asking the front proxy to send file_path (it handles Range itself)."""
+    response = Response(mimetype=mimetype)
+    try:
+        download_name.encode('ascii')
+        names = {'filename': download_name}
+    except UnicodeEncodeError:
+        names = {
+            'filename': download_name.encode('ascii', 'ignore').decode('ascii') or 'audio',
+            'filename*': f"UTF-8''{quote(download_name)}"
+        }
+    response.headers.set('Content-Disposition', 'attachment', **names)
+    response.set_etag(etag)
+    response.last_modified = st.st_mtime
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+    if DOWNLOAD_OFFLOAD == 'x-accel':
+        relative = os.path.relpath(file_path, DOWNLOADS_DIR).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative)
+    else:
+        response.headers['X-Sendfile'] = file_path
+    return response
 
 @app.route('/download/<progress_id>')
 def download_file(progress_id):
-    """Download the converted MP3 file"""
+    """Download the converted audio file"""
     try:
-        downloads_dir = os.path.join(os.getcwd(), 'downloads')
         file_path = None
         filename = None
         
@@ -406,57 +2959,236 @@ def download_file(progress_id):
         if progress and progress.get('status') == 'completed':
             file_path = progress.get('file_path')
             filename = progress.get('filename')
-            
-            if file_path and os.path.exists(file_path):
-                logger.debug(f"Using file from progress: {file_path}")
-            else:
-                file_path = None
-        
-        # If no valid file from progress, find any available MP3 file
+
+        # Otherwise use the file index (e.g. after a restart)
         if not file_path:
-            mp3_files = [f for f in os.listdir(downloads_dir) if f.endswith('.mp3')]
-            
-            if mp3_files:
-                # Get the most recent MP3 file
-                latest_file = max(mp3_files, key=lambda x: os.path.getctime(os.path.join(downloads_dir, x)))
-                file_path = os.path.join(downloads_dir, latest_file)
-                filename = latest_file
-                logger.debug(f"Using most recent file: {file_path}")
-            else:
-                logger.error(f"No MP3 files found in downloads directory")
-                return jsonify({'error': 'Aucun fichier MP3 disponible'}), 404
+            link = output_cache.get_for_job(progress_id)
+            if link:
+                file_path = link['file_path']
+                filename = link['filename']
+
+        if not file_path:
+            logger.error(f"No file recorded for {progress_id}")
+            return jsonify({'error': 'Conversion non trouvée'}), 404
         
         if not os.path.exists(file_path):
             logger.error(f"File does not exist: {file_path}")
             return jsonify({'error': 'Fichier non trouvé'}), 404
             
         # Clean the filename for download
+        extension = os.path.splitext(file_path)[1].lstrip('.').lower()
+        if extension not in OUTPUT_FORMATS:
+            extension = AUDIO_CODEC
         clean_filename = re.sub(r'[^\w\s\-\.]', '', filename)
         clean_filename = re.sub(r'[\-\s]+', '-', clean_filename)
-        if not clean_filename.endswith('.mp3'):
-            clean_filename += '.mp3'
+        if not clean_filename.endswith(f'.{extension}'):
+            clean_filename += f'.{extension}'
             
         logger.debug(f"Sending file: {file_path} as {clean_filename}")
-        
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=clean_filename,
-            mimetype='audio/mpeg'
-        )
+        output_cache.touch(file_path)
+        st = os.stat(file_path)
+        etag = _file_etag(file_path, st)
+        mimetype = OUTPUT_FORMATS[extension]['mimetype']
+
+        if DOWNLOAD_OFFLOAD in ('x-accel', 'x-sendfile'):
+            response = _offloaded_file_response(file_path, clean_filename, mimetype, st, etag)
+            sent = 0 if response.status_code == 304 else st.st_size
+        else:
+            # Conditional: answers If-None-Match/If-Modified-Since with 304
+            # and Range/If-Range with 206, so interrupted downloads resume
+            response = send_file(
+                file_path,
+                as_attachment=True,
+                download_name=clean_filename,
+                mimetype=mimetype,
+                conditional=True,
+                etag=etag,
+                last_modified=st.st_mtime
+            )
+            sent = (response.content_length or 0) if response.status_code in (200, 206) else 0
+        response.cache_control.no_cache = None
+        response.cache_control.private = True
+        response.cache_control.max_age = DOWNLOAD_MAX_AGE
+        metrics.inc('ytconv_served_bytes_total', sent, route='download')
+        return response
         
     except Exception as e:
         logger.error(f"Error downloading file: {str(e)}")
         return jsonify({'error': 'Erreur lors du téléchargement'}), 500
 
+@app.route('/download/stream', methods=['GET', 'POST'])
+def stream_download():
+    """Convert and send audio while it is being encoded (no file on disk)"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form
+    else:
+        data = request.args
+    url = data.get('url', '').strip()
+    url = normalize_url(url) if url else ''
+
+    if not url or not is_valid_youtube_url(url):
+        return jsonify({'error': 'URL YouTube invalide'}), 400
+
+    output_format = _requested_format(data)
+    if not output_format:
+        return jsonify({'error': 'Format non pris en charge (mp3, m4a, opus)'}), 400
+
+    # Streams do not wait for an FFmpeg slot: the client would time out
+    if not _stream_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Serveur occupé, veuillez réessayer dans quelques instants.'})
+        response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return response, 429
+    if not ffmpeg_governor.acquire(blocking=False):
+        _stream_slots.release()
+        response = jsonify({'error': 'Serveur occupé, veuillez réessayer dans quelques instants.'})
+        response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return response, 429
+
+    try:
+        ydl, info, proc, feeder, stop = _open_stream(url, output_format)
+    except Exception as e:
+        ffmpeg_governor.release()
+        _stream_slots.release()
+        logger.error(f"Error starting stream: {str(e)}")
+        return jsonify({'error': 'Erreur lors de la conversion'}), 502
+
+    def close():
+        stop.set()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        if feeder is not None:
+            feeder.join(timeout=5)
+        ydl.close()
+        ffmpeg_governor.release()
+        _stream_slots.release()
+
+    # Wait for the first encoded bytes so startup failures still get a proper status
+    first_chunk = proc.stdout.read1(STREAM_CHUNK_SIZE)
+    if not first_chunk:
+        close()
+        return jsonify({'error': 'Erreur lors de la conversion'}), 502
+
+    def generate():
+        sent = 0
+        try:
+            yield first_chunk
+            sent += len(first_chunk)
+            while True:
+                chunk = proc.stdout.read1(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+                sent += len(chunk)
+        finally:
+            metrics.inc('ytconv_served_bytes_total', sent, route='stream')
+            close()
+
+    clean_filename = re.sub(r'[^\w\s\-\.]', '', info.get('title') or 'audio')
+    clean_filename = re.sub(r'[\-\s]+', '-', clean_filename) + f'.{output_format}'
+    response = Response(generate(), mimetype=OUTPUT_FORMATS[output_format]['mimetype'], direct_passthrough=True)
+    response.headers['Content-Disposition'] = f'attachment; filename="{clean_filename}"'
+    # Ask front proxies (nginx) not to buffer the whole stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # Debug route to see current conversions
 @app.route('/debug/conversions')
 def debug_conversions():
-    """Debug endpoint to see current conversions"""
+    """Debug endpoint to see current conversions (?page=, ?per_page=, ?status=)"""
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(200, max(1, request.args.get('per_page', 50, type=int)))
+    status = request.args.get('status') or None
+    total, items = conversion_progress.page(status=status, offset=(page - 1) * per_page, limit=per_page)
+    return jsonify({
+        'conversions': dict(items),
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'status': status,
+        'metadata_cache': metadata_cache.stats(),
+        'extract_cache': extract_cache.stats(),
+        'scheduler': scheduler.stats(),
+        'ffmpeg': ffmpeg_governor.stats(),
+        'bandwidth': bandwidth.stats(),
+        'storage': janitor.stats()
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint, aggregated over all worker processes"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/extractors')
+def debug_extractors():
+    """Debug endpoint to see extractor config health and the current attempt order"""
     return jsonify({
-        'conversions': conversion_progress,
-        'downloads_dir_files': os.listdir(os.path.join(os.getcwd(), 'downloads'))
+        'order': [name for name, _ in extractor_health.order(_extractor_configs())],
+        'configs': extractor_health.stats(),
+        'ydl_pool': ydl_pool.stats()
+    })
+
+@app.route('/debug/storage')
+def debug_storage():
+    """Debug endpoint to see downloads directory usage and janitor evictions"""
+    return jsonify({**janitor.stats(), 'ytdl_cache': ytdl_cache.stats()})
+
+# Upper bound for the 'wait' parameter of the API endpoints, in seconds
+API_MAX_WAIT = int(os.environ.get('API_MAX_WAIT', '60'))
+
+def _requested_wait(data):
+    """Return the 'wait' request parameter in seconds (capped), or None when absent or invalid."""
+    try:
+        wait = float(data.get('wait'))
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, min(wait, API_MAX_WAIT))
+
+def _wait_for_progress(progress_id, timeout):
+    """Wait until a job completes or fails, or timeout expires; return its latest record."""
+    deadline = time.monotonic() + timeout
+    version = -1
+    while True:
+        record = conversion_progress.get(progress_id)
+        if record is None or record['status'] in ('completed', 'error'):
+            return record
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return record
+        version = conversion_progress.wait_for_change(progress_id, version, min(remaining, SSE_POLL_INTERVAL))
+
+def _api_job_response(progress_id, record, title=None):
+    """API answer for a conversion: 200 when done, 202 while running, 500 on failure."""
+    record = record or {'status': 'queued', 'percent': 0}
+    if record['status'] == 'completed':
+        return jsonify({
+            'success': True,
+            'status': 'completed',
+            'title': title or os.path.splitext(record.get('filename') or '')[0],
+            'progress_id': progress_id,
+            'download_url': url_for('download_file', progress_id=progress_id, _external=True)
+        })
+    if record['status'] == 'error':
+        return jsonify({
+            'success': False,
+            'status': 'error',
+            'progress_id': progress_id,
+            'error': _progress_message(record)
+        }), 500
+    status_url = url_for('api_status', progress_id=progress_id, _external=True)
+    response = jsonify({
+        'success': True,
+        'status': record['status'],
+        'title': title,
+        'progress_id': progress_id,
+        'percent': record.get('percent', 0),
+        'message': _progress_message(record),
+        'status_url': status_url
     })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
 
 # API Routes for iOS Shortcuts
 @app.route('/api/convert', methods=['POST'])
@@ -464,16 +3196,33 @@ def api_convert():
     """API endpoint for iOS Shortcuts - convert YouTube URL to MP3"""
     try:
         # Handle both JSON and form data
-        if request.is_json:
-            url = normalize_url(request.json.get('url', '').strip())
-        else:
-            url = normalize_url(request.form.get('url', '').strip())
+        data = request.json if request.is_json else request.form
+        url = normalize_url(data.get('url', '').strip())
             
         if not url:
             return jsonify({'error': 'URL required', 'success': False}), 400
             
         if not is_valid_youtube_url(url):
             return jsonify({'error': 'Invalid YouTube URL', 'success': False}), 400
+
+        output_format = _requested_format(data)
+        if not output_format:
+            return jsonify({'error': 'Unsupported format (mp3, m4a, opus)', 'success': False}), 400
+
+        # Already converted: answer without touching YouTube
+        cached = output_cache.get(extract_video_id(url), output_format)
+        if cached:
+            progress_id = f"api_conv_{int(time.time())}_{os.urandom(3).hex()}"
+            record = _cached_progress(cached)
+            conversion_progress[progress_id] = record
+            output_cache.link([progress_id], cached['file_path'], record['filename'])
+            return jsonify({
+                'success': True,
+                'title': cached.get('title'),
+                'progress_id': progress_id,
+                'download_url': url_for('download_file', progress_id=progress_id, _external=True),
+                'cached': True
+            })
             
         # Get video info
         video_info = get_video_info(url)
@@ -481,11 +3230,28 @@ def api_convert():
             return jsonify({'error': 'Could not extract video information', 'success': False}), 400
             
         # Start conversion
-        progress_id = f"api_conv_{int(time.time())}_{hash(url) % 10000}"
+        progress_id = f"api_conv_{int(time.time())}_{os.urandom(3).hex()}"
+
+        # With 'wait', block at most that long and hand back a status URL otherwise
+        wait = _requested_wait(data)
+        if wait is not None:
+            try:
+                job = start_conversion(url, progress_id, output_format)
+            except QueueFullError:
+                response = jsonify({'error': 'Server busy, retry later', 'success': False})
+                response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+                return response, 429
+            job.done.wait(wait)
+            return _api_job_response(progress_id, conversion_progress.get(progress_id), video_info['title'])
         
-        # For API, we'll do synchronous conversion (blocking)
+        # Without 'wait', we do synchronous conversion (blocking)
         # This is simpler for iOS Shortcuts
-        file_path = download_and_convert(url, progress_id)
+        try:
+            file_path = download_and_convert(url, progress_id, output_format)
+        except QueueFullError:
+            response = jsonify({'error': 'Server busy, retry later', 'success': False})
+            response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            return response, 429
         
         if not file_path or not os.path.exists(file_path):
             return jsonify({'error': 'Conversion failed', 'success': False}), 500
@@ -501,6 +3267,16 @@ def api_convert():
         logger.error(f"API conversion error: {str(e)}")
         return jsonify({'error': str(e), 'success': False}), 500
 
+@app.route('/api/status/<progress_id>', methods=['GET', 'POST'])
+def api_status(progress_id):
+    """API endpoint to poll a conversion; 'wait' long-polls up to N seconds for completion"""
+    data = request.args if request.method == 'GET' else (request.get_json(silent=True) or request.form)
+    wait = _requested_wait(data) or 0
+    record = _wait_for_progress(progress_id, wait)
+    if record is None:
+        return jsonify({'error': 'Conversion not found', 'success': False, 'status': 'not_found'}), 404
+    return _api_job_response(progress_id, record)
+
 @app.route('/api/info', methods=['POST'])
 def api_info():
     """API endpoint to get video information only"""
@@ -529,6 +3305,191 @@ def api_info():
         logger.error(f"API info error: {str(e)}")
         return jsonify({'error': str(e), 'success': False}), 500
 
+# Batch conversions: limits on items per batch and on the conversions a
+# batch runs at once (the scheduler still bounds the total)
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '50'))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '3'))
+
+def expand_playlist(playlist_id, limit):
+    """Return [(video_url, title), ...] for the first `limit` videos of a playlist."""
+    configs = [
+        (name, {**ydl_opts, 'extract_flat': 'in_playlist', 'playlistend': limit})
+        for name, ydl_opts in extractor_health.order(_extractor_configs())
+    ]
+    info, _ = _extract_sequential(f'https://www.youtube.com/playlist?list={playlist_id}', configs,
+                                  variant='playlist', raise_error=True)
+    videos = []
+    for entry in info.get('entries') or []:
+        if entry and entry.get('id') and len(videos) < limit:
+            videos.append((f"https://www.youtube.com/watch?v={entry['id']}", entry.get('title')))
+    return videos
+
+class ConversionBatch:
+    """Conversions started together under one batch ID, at most `concurrency` at a time.
+
+    The batch record is kept in the job store next to the items' progress
+    records, so any worker can report on it; the items are started by a
+    thread of the worker that created the batch.
+    """
+
+    def __init__(self, batch_id, videos, output_format, concurrency, truncated=False):
+        self.batch_id = batch_id
+        self.truncated = truncated
+        self.output_format = output_format
+        self.concurrency = concurrency
+        self.created_at = time.time()
+        self.items = [
+            {'url': url, 'title': title, 'progress_id': f'{batch_id}_{index}'}
+            for index, (url, title) in enumerate(videos)
+        ]
+
+    def publish(self, status):
+        conversion_progress.set(self.batch_id, {
+            'status': status,
+            'kind': 'batch',
+            'format': self.output_format,
+            'concurrency': self.concurrency,
+            'items': self.items,
+            'truncated': self.truncated,
+            'started_at': self.created_at,
+            'updated_at': time.time()
+        })
+
+    def start(self):
+        now = time.time()
+        conversion_progress.set_many(
+            [item['progress_id'] for item in self.items],
+            {'status': 'queued', 'percent': 0, 'updated_at': now}
+        )
+        self.publish('queued')
+        threading.Thread(target=self._run, name=f'batch-{self.batch_id}', daemon=True).start()
+
+    def _start_item(self, item):
+        """Start one item; returns its job, or None when it was answered from the cache."""
+        cached = output_cache.get(extract_video_id(item['url']), self.output_format)
+        if cached:
+            record = _cached_progress(cached)
+            conversion_progress.set(item['progress_id'], record)
+            output_cache.link([item['progress_id']], cached['file_path'], record['filename'])
+            return None
+        # Items wait for room rather than fail: the batch is already accepted
+        return start_conversion(item['url'], item['progress_id'], self.output_format, block=True)
+
+    def _run(self):
+        try:
+            self.publish('processing')
+            running = []
+            for item in self.items:
+                while len(running) >= self.concurrency:
+                    running[0].done.wait(0.5)
+                    running = [job for job in running if not job.done.is_set()]
+                job = self._start_item(item)
+                if job is not None:
+                    running.append(job)
+            for job in running:
+                job.done.wait()
+            self.publish('completed')
+        except Exception as e:
+            logger.error(f"Batch {self.batch_id} error: {str(e)}")
+            self.publish('error')
+
+def _batch_response(batch_id, batch):
+    """API answer for a batch: aggregate progress plus every item; 200 when all items are done."""
+    items, counts, percent_total = [], {}, 0
+    for item in batch['items']:
+        record = conversion_progress.get(item['progress_id']) or {'status': 'queued', 'percent': 0}
+        status = record['status']
+        counts[status] = counts.get(status, 0) + 1
+        percent_total += 100 if status in ('completed', 'error') else record.get('percent', 0)
+        view = {
+            'url': item['url'],
+            'title': item.get('title') or os.path.splitext(record.get('filename') or '')[0] or None,
+            'progress_id': item['progress_id'],
+            'status': status,
+            'percent': record.get('percent', 0),
+            'message': _progress_message(record)
+        }
+        if status == 'completed':
+            view['download_url'] = url_for('download_file', progress_id=item['progress_id'], _external=True)
+        items.append(view)
+    done = batch['status'] in ('completed', 'error')
+    status_url = url_for('api_batch_status', batch_id=batch_id, _external=True)
+    response = jsonify({
+        'success': batch['status'] != 'error',
+        'batch_id': batch_id,
+        'status': batch['status'],
+        'format': batch.get('format'),
+        'total': len(items),
+        'completed': counts.get('completed', 0),
+        'failed': counts.get('error', 0),
+        'percent': round(percent_total / len(items), 1) if items else 100,
+        'truncated': batch.get('truncated', False),
+        'items': items,
+        'status_url': status_url
+    })
+    if not done:
+        response.status_code = 202
+        response.headers['Location'] = status_url
+    return response
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """API endpoint to convert several URLs or a playlist in one request"""
+    try:
+        data = request.get_json(silent=True) or request.form
+        output_format = _requested_format(data)
+        if not output_format:
+            return jsonify({'error': 'Unsupported format (mp3, m4a, opus)', 'success': False}), 400
+
+        urls = data.get('urls')
+        if isinstance(urls, str):
+            urls = urls.split()
+        url = (data.get('playlist') or data.get('url') or '').strip()
+        truncated = False
+        if urls:
+            if len(urls) > BATCH_MAX_ITEMS:
+                return jsonify({'error': f'Too many URLs (max {BATCH_MAX_ITEMS})', 'success': False}), 400
+            videos = []
+            for candidate in urls:
+                candidate = normalize_url(str(candidate).strip())
+                if not is_valid_youtube_url(candidate):
+                    return jsonify({'error': f'Invalid YouTube URL: {candidate}', 'success': False}), 400
+                if candidate not in (seen for seen, _ in videos):
+                    videos.append((candidate, None))
+        elif url and extract_playlist_id(url):
+            # One more than the limit tells whether the playlist was cut
+            videos = expand_playlist(extract_playlist_id(url), BATCH_MAX_ITEMS + 1)
+            truncated = len(videos) > BATCH_MAX_ITEMS
+            videos = videos[:BATCH_MAX_ITEMS]
+            if not videos:
+                return jsonify({'error': 'Empty or unavailable playlist', 'success': False}), 400
+        else:
+            return jsonify({'error': 'urls list or playlist URL required', 'success': False}), 400
+
+        try:
+            concurrency = int(data.get('concurrency') or BATCH_MAX_CONCURRENCY)
+        except (TypeError, ValueError):
+            concurrency = BATCH_MAX_CONCURRENCY
+        concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+
+        batch_id = f"batch_{int(time.time())}_{os.urandom(3).hex()}"
+        ConversionBatch(batch_id, videos, output_format, concurrency, truncated).start()
+        return _batch_response(batch_id, conversion_progress.get(batch_id))
+
+    except Exception as e:
+        logger.error(f"API batch error: {str(e)}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@app.route('/api/batch/<batch_id>', methods=['GET', 'POST'])
+def api_batch_status(batch_id):
+    """API endpoint to poll a batch; 'wait' long-polls up to N seconds for completion"""
+    data = request.args if request.method == 'GET' else (request.get_json(silent=True) or request.form)
+    wait = _requested_wait(data) or 0
+    batch = _wait_for_progress(batch_id, wait)
+    if batch is None or batch.get('kind') != 'batch':
+        return jsonify({'error': 'Batch not found', 'success': False, 'status': 'not_found'}), 404
+    return _batch_response(batch_id, batch)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
 
@@ -0,0 +1,184 @@
+"""Offline stand-ins for yt-dlp and FFmpeg used by the benchmark suite.
+
+FakeYoutubeDL implements the part of the yt_dlp.YoutubeDL interface that
+app.py uses (extract_info, process_ie_result, process_info,
+prepare_filename, urlopen) and serves a synthetic WAV file, with
+configurable latency, per-connection rate and failures.
+"""
+import io
+import math
+import os
+import random
+import struct
+import threading
+import time
+import wave
+
+import yt_dlp
+
+# Tunables, set through configure()
+SETTINGS = {
+    'extract_latency': 0.2,      # seconds per extract_info call
+    'download_latency': 0.5,     # seconds before the first byte
+    'download_rate': 4 * 1024 * 1024,  # bytes per second once started
+    'duration': 30,              # seconds of synthetic audio
+    'extract_failure_rate': 0.0,
+    'download_failure_rate': 0.0,
+    'jitter': 0.2,               # +/- fraction applied to every delay
+}
+
+_audio_lock = threading.Lock()
+_audio_cache = {}
+
+
+def configure(**settings):
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown fake backend settings: {', '.join(sorted(unknown))}")
+    SETTINGS.update(settings)
+
+
+def install(app_module):
+    """Route every YoutubeDL built by app_module through the fake."""
+    app_module.yt_dlp.YoutubeDL = FakeYoutubeDL
+
+
+def synthetic_audio(duration):
+    """A mono 8 kHz 16-bit WAV sine tone of the given length, cached per duration."""
+    with _audio_lock:
+        data = _audio_cache.get(duration)
+        if data is None:
+            rate = 8000
+            frames = b''.join(
+                struct.pack('<h', int(12000 * math.sin(2 * math.pi * 440 * i / rate)))
+                for i in range(rate)
+            ) * max(1, int(duration))
+            buffer = io.BytesIO()
+            with wave.open(buffer, 'wb') as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(rate)
+                f.writeframes(frames)
+            data = _audio_cache[duration] = buffer.getvalue()
+        return data
+
+
+def _sleep(seconds):
+    if seconds > 0:
+        jitter = SETTINGS['jitter']
+        time.sleep(seconds * random.uniform(1 - jitter, 1 + jitter))
+
+
+def _maybe_fail(rate, what):
+    if rate and random.random() < rate:
+        raise yt_dlp.utils.DownloadError(f"ERROR: [fake] simulated {what} failure")
+
+
+class _FakeResponse(io.BytesIO):
+    status = 206
+
+    def __init__(self, data, start, total):
+        super().__init__(data)
+        self.headers = {'Content-Range': f'bytes {start}-{start + len(data) - 1}/{total}'}
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        if chunk and SETTINGS['download_rate']:
+            _sleep(len(chunk) / SETTINGS['download_rate'])
+        return chunk
+
+
+class FakeYoutubeDL:
+    def __init__(self, params=None, auto_init=True):
+        self.params = dict(params or {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def get_info_extractor(self, ie_key):
+        return None
+
+    def add_progress_hook(self, hook):
+        self.params.setdefault('progress_hooks', []).append(hook)
+
+    def _info(self, url):
+        from app import extract_video_id
+        video_id = extract_video_id(url) or 'unknown'
+        audio = synthetic_audio(SETTINGS['duration'])
+        return {
+            'id': video_id,
+            'title': f'Bench {video_id}',
+            'duration': SETTINGS['duration'],
+            'uploader': 'bench',
+            'view_count': 0,
+            'thumbnail': '',
+            'webpage_url': url,
+            'ext': 'wav',
+            'acodec': 'pcm_s16le',
+            'protocol': 'https',
+            'url': f'https://fake.invalid/{video_id}.wav',
+            'filesize': len(audio),
+            'http_headers': {},
+        }
+
+    def extract_info(self, url, download=False, process=True):
+        _sleep(SETTINGS['extract_latency'])
+        _maybe_fail(SETTINGS['extract_failure_rate'], 'extraction')
+        info = self._info(url)
+        return self.process_ie_result(info, download=True) if download else info
+
+    def prepare_filename(self, info):
+        template = self.params.get('outtmpl') or '%(title)s [%(id)s].%(ext)s'
+        if isinstance(template, dict):
+            template = template.get('default')
+        return template % {'title': info['title'], 'id': info['id'], 'ext': info.get('ext', 'wav')}
+
+    def process_ie_result(self, info, download=True):
+        if not download:
+            return info
+        path = self.process_info(info)
+        return {**info, 'requested_downloads': [{'filepath': path}]}
+
+    def process_info(self, info):
+        _sleep(SETTINGS['download_latency'])
+        _maybe_fail(SETTINGS['download_failure_rate'], 'download')
+        audio = synthetic_audio(SETTINGS['duration'])
+        path = self.prepare_filename(info)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        hooks = self.params.get('progress_hooks') or []
+        chunk = max(1, len(audio) // 10)
+        with open(path, 'wb') as f:
+            for offset in range(0, len(audio), chunk):
+                f.write(audio[offset:offset + chunk])
+                rate = min(filter(None, (SETTINGS['download_rate'], self.params.get('ratelimit'))), default=None)
+                if rate:
+                    _sleep(chunk / rate)
+                for hook in hooks:
+                    hook({
+                        'status': 'downloading',
+                        'downloaded_bytes': min(len(audio), offset + chunk),
+                        'total_bytes': len(audio),
+                    })
+        for hook in hooks:
+            hook({'status': 'finished', 'downloaded_bytes': len(audio), 'total_bytes': len(audio), 'filename': path})
+        return path
+
+    def urlopen(self, req):
+        """Serve Range requests on the synthetic audio (ranged downloads and /download/stream)."""
+        _sleep(SETTINGS['download_latency'])
+        _maybe_fail(SETTINGS['download_failure_rate'], 'download')
+        audio = synthetic_audio(SETTINGS['duration'])
+        start, end = 0, len(audio) - 1
+        header = dict(req.headers).get('Range', '')
+        if header.startswith('bytes='):
+            first, _, last = header[6:].partition('-')
+            start = int(first or 0)
+            end = min(end, int(last)) if last else end
+        return _FakeResponse(audio[start:end + 1], start, len(audio))
+
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Minimal FFmpeg stand-in for machines without FFmpeg.
+
+Understands the command lines built by app.py: copies the input (a file or
+pipe:0) to the output (a file or pipe:1), reports -progress lines and
+spends BENCH_FFMPEG_SPEED seconds of CPU-free delay per second of audio.
+"""
+import os
+import shutil
+import sys
+import time
+
+SPEED = float(os.environ.get('BENCH_FFMPEG_SPEED', '0.01'))
+
+
+def main(argv):
+    source = argv[argv.index('-i') + 1]
+    output = argv[-1]
+    duration = float(os.environ.get('BENCH_AUDIO_DURATION', '30'))
+    progress = '-progress' in argv and argv[argv.index('-progress') + 1] == 'pipe:1'
+
+    if source == 'pipe:0':
+        shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)
+        return 0
+
+    steps = 5
+    for step in range(1, steps + 1):
+        time.sleep(duration * SPEED / steps)
+        if progress:
+            print(f'out_time_us={int(duration * 1e6 * step / steps)}', flush=True)
+            print('progress=continue', flush=True)
+    if output == 'pipe:1':
+        with open(source, 'rb') as f:
+            shutil.copyfileobj(f, sys.stdout.buffer)
+    else:
+        shutil.copyfile(source, output)
+    if progress:
+        print(f'total_size={os.path.getsize(output) if output != "pipe:1" else 0}', flush=True)
+        print('progress=end', flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Offline load test for the converter with a fake yt-dlp backend.
+
+Starts app.py on a local port with yt-dlp replaced by bench/fake_backend.py
+(and FFmpeg by bench/fake_ffmpeg.py unless --real-ffmpeg is given), drives
+the selected scenarios at a fixed concurrency and reports throughput and
+p50/p95/p99 latency.
+
+    python bench/run.py --requests 200 --concurrency 16
+    python bench/run.py --scenario api --failure-rate 0.05 --json out.json
+    python bench/run.py --baseline out.json
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+SCENARIOS = ('validate', 'convert', 'api')
+
+
+class Client:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def request(self, method, path, payload=None):
+        """Return (status, body bytes) for a request to the app."""
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(
+            self.base_url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json'} if data else {}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def json(self, method, path, payload=None):
+        status, body = self.request(method, path, payload)
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, {}
+
+
+def video_url(i, args):
+    # 11-character IDs accepted by extract_video_id, distinct per scenario
+    return f'https://youtu.be/b{args.round}{i % args.videos:09d}'
+
+
+def run_validate(client, i, args):
+    status, body = client.json('POST', '/validate', {'url': video_url(i, args)})
+    return status == 200 and body.get('valid') and not body.get('warning')
+
+
+def run_convert(client, i, args):
+    status, body = client.json('POST', '/convert', {'url': video_url(i, args), 'format': args.format})
+    if status != 200:
+        return False
+    progress_id = body['progress_id']
+    while True:
+        status, progress = client.json('GET', f'/progress/{progress_id}')
+        if progress.get('status') == 'completed':
+            break
+        if progress.get('status') in ('error', 'not_found'):
+            return False
+        time.sleep(args.poll_interval)
+    status, data = client.request('GET', f'/download/{progress_id}')
+    return status == 200 and len(data) > 0
+
+
+def run_api(client, i, args):
+    status, body = client.json('POST', '/api/convert', {'url': video_url(i, args), 'format': args.format})
+    if status != 200 or not body.get('success'):
+        return False
+    path = body['download_url'].split(client.base_url, 1)[-1]
+    status, data = client.request('GET', path)
+    return status == 200 and len(data) > 0
+
+
+RUNNERS = {'validate': run_validate, 'convert': run_convert, 'api': run_api}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def run_scenario(name, client, args):
+    latencies, failures = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal failures
+        started = time.perf_counter()
+        try:
+            ok = RUNNERS[name](client, i, args)
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                failures += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - started
+    return {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'failures': failures,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(args.requests / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def print_report(results, baseline=None):
+    columns = ('requests', 'failures', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')
+    print(f"{'scenario':<10}" + ''.join(f'{c:>16}' for c in columns))
+    for name, result in results.items():
+        cells = []
+        for column in columns:
+            cell = f'{result[column]}'
+            base = (baseline or {}).get(name, {}).get(column)
+            if base and column not in ('requests', 'failures'):
+                cell += f' ({(result[column] - base) / base * 100:+.0f}%)'
+            cells.append(f'{cell:>16}')
+        print(f'{name:<10}' + ''.join(cells))
+
+
+def start_server(args):
+    """Import app.py in a scratch directory with the fake backend and serve it on a free port."""
+    workdir = tempfile.mkdtemp(prefix='ytconv-bench-')
+    os.chdir(workdir)
+    os.environ['BENCH_AUDIO_DURATION'] = str(args.duration)
+    if not args.real_ffmpeg:
+        os.environ['FFMPEG_PATH'] = os.path.join(BENCH_DIR, 'fake_ffmpeg.py')
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, BENCH_DIR)
+
+    import fake_backend
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    logging.disable(logging.INFO)
+    fake_backend.install(app_module)
+    fake_backend.configure(
+        extract_latency=args.extract_latency,
+        download_latency=args.download_latency,
+        download_rate=args.download_rate,
+        duration=args.duration,
+        extract_failure_rate=args.failure_rate,
+        download_failure_rate=args.failure_rate,
+    )
+    server = make_server('127.0.0.1', 0, app_module.application, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_path = app_module.BASE_PATH
+    return server, workdir, f'http://127.0.0.1:{server.server_port}{base_path}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='scenario to run (repeatable, default: all)')
+    parser.add_argument('--requests', type=int, default=100, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--videos', type=int, default=1000,
+                        help='distinct videos to cycle through (lower means more cache hits)')
+    parser.add_argument('--format', default='mp3')
+    parser.add_argument('--extract-latency', type=float, default=0.2)
+    parser.add_argument('--download-latency', type=float, default=0.5)
+    parser.add_argument('--download-rate', type=float, default=4 * 1024 * 1024, help='bytes per second')
+    parser.add_argument('--duration', type=int, default=30, help='seconds of synthetic audio per video')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='probability that an extraction or a download fails')
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--real-ffmpeg', action='store_true', help='encode with the FFmpeg found by app.py')
+    parser.add_argument('--json', metavar='PATH', help='write results to PATH')
+    parser.add_argument('--baseline', metavar='PATH', help='compare with results written by --json')
+    args = parser.parse_args()
+
+    args.json = args.json and os.path.abspath(args.json)
+    args.baseline = args.baseline and os.path.abspath(args.baseline)
+    server, workdir, base_url = start_server(args)
+    client = Client(base_url, args.timeout)
+    results = {}
+    try:
+        for index, name in enumerate(args.scenario or SCENARIOS):
+            # Each scenario starts on fresh videos so earlier ones do not warm its caches
+            args.round = index
+            results[name] = run_scenario(name, client, args)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,15 @@
 // YouTube to MP3 Converter JavaScript
 
+// How long a conversion may stay unknown before the UI gives up on it: with
+// a per-process job store, requests reaching another worker see not_found
+const NOT_FOUND_GRACE_MS = 10000;
+
 class YouTubeConverter {
     constructor() {
         this.currentProgressId = null;
         this.progressInterval = null;
+        this.progressSource = null;
+        this.notFoundSince = null;
         this.initializeElements();
         this.bindEvents();
     }
@@ -73,10 +79,7 @@ class YouTubeConverter {
         this.validateBtn.disabled = false;
         
         // Clear progress
-        if (this.progressInterval) {
-            clearInterval(this.progressInterval);
-            this.progressInterval = null;
-        }
+        this.stopProgressTracking();
     }
 
     showError(message) {
@@ -218,31 +221,88 @@ class YouTubeConverter {
     }
 
     startProgressTracking() {
+        this.notFoundSince = null;
+        // Prefer server-pushed updates; fall back to polling if SSE is unavailable
+        if (window.EventSource) {
+            this.startProgressStream();
+        } else {
+            this.startProgressPolling();
+        }
+    }
+
+    startProgressStream() {
+        const API_BASE = (window.API_BASE || '').replace(/\/$/, '');
+        const source = new EventSource(`${API_BASE}/progress/${this.currentProgressId}/stream`);
+        this.progressSource = source;
+
+        source.onmessage = (event) => {
+            try {
+                this.handleProgress(JSON.parse(event.data));
+            } catch (error) {
+                console.error('Progress stream error:', error);
+            }
+        };
+
+        source.onerror = () => {
+            // Stream dropped before completion (proxy, timeout...): keep going with polling
+            if (this.progressSource === source) {
+                source.close();
+                this.progressSource = null;
+                this.startProgressPolling();
+            }
+        };
+    }
+
+    startProgressPolling() {
         this.progressInterval = setInterval(async () => {
             try {
                 const API_BASE = (window.API_BASE || '').replace(/\/$/, '');
                 const response = await fetch(`${API_BASE}/progress/${this.currentProgressId}`);
                 const data = await response.json();
 
-                this.updateProgress(data);
-
-                if (data.status === 'completed') {
-                    clearInterval(this.progressInterval);
-                    this.showDownload();
-                } else if (data.status === 'error') {
-                    clearInterval(this.progressInterval);
-                    this.showError(data.message || 'Erreur lors de la conversion');
-                    this.resetConvertButton();
-                }
+                this.handleProgress(data);
             } catch (error) {
                 console.error('Progress tracking error:', error);
-                clearInterval(this.progressInterval);
+                this.stopProgressTracking();
                 this.showError('Erreur lors du suivi de progression');
                 this.resetConvertButton();
             }
         }, 1000);
     }
 
+    stopProgressTracking() {
+        if (this.progressSource) {
+            this.progressSource.close();
+            this.progressSource = null;
+        }
+        if (this.progressInterval) {
+            clearInterval(this.progressInterval);
+            this.progressInterval = null;
+        }
+    }
+
+    handleProgress(data) {
+        if (data.status === 'not_found') {
+            this.notFoundSince = this.notFoundSince || Date.now();
+            if (Date.now() - this.notFoundSince < NOT_FOUND_GRACE_MS) {
+                return;
+            }
+        } else {
+            this.notFoundSince = null;
+        }
+
+        this.updateProgress(data);
+
+        if (data.status === 'completed') {
+            this.stopProgressTracking();
+            this.showDownload();
+        } else if (data.status === 'error' || data.status === 'not_found') {
+            this.stopProgressTracking();
+            this.showError(data.message || 'Erreur lors de la conversion');
+            this.resetConvertButton();
+        }
+    }
+
     updateProgress(data) {
         const percent = data.percent || 0;
         const message = data.message || 'Traitement en cours...';
@@ -257,7 +317,7 @@ class YouTubeConverter {
         
         if (data.status === 'completed') {
             this.progressBar.classList.add('bg-success');
-        } else if (data.status === 'error') {
+        } else if (data.status === 'error' || data.status === 'not_found') {
             this.progressBar.classList.add('bg-danger');
         } else {
             this.progressBar.classList.add('bg-primary');